@@ -0,0 +1,462 @@
+"""
+benchmark_baselines.py
+
+This file tracks the run time, peak memory and numbers of the report
+stages against stored baselines, so changes to the report scripts can be
+checked rather than guessed at.
+
+Every stage of spineleaf_network_report and owcell_network_report is run on
+fixed reference result files. The median of several timed runs, the peak
+Python heap of one traced run (tracemalloc) and the metrics the stage
+produces (drop counts, utilization averages, CDF quantiles, ...) are stored in
+a JSON baseline. check reruns the stages and flags any stage that got slower
+or used more memory beyond a threshold, or whose metrics drifted, exiting
+with status 1 when anything regressed. A stage that looks slower is run
+again before being flagged, so a single noisy trial does not fail the check.
+
+Figures are encoded synchronously (figure_output workers=0), so their
+encoding is part of the time and the traced peak does not depend on when
+background work happens to run.
+
+Usage:
+python benchmark_baselines.py record --spineleaf test-#0.vec test-#0.sca --owcell test-#3.vec test-#3.sca
+python benchmark_baselines.py check [--threshold 0.2] [--stages spineleaf]
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import math
+import os
+import platform
+import re
+import statistics
+import tempfile
+import time
+import tracemalloc
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import spineleaf_network_report as spineleaf
+import owcell_network_report as owcell
+import vector_aggregation
+import traffic_matrix
+import run_info
+import param_values
+import figure_output
+
+
+# Default file the baselines are stored in.
+BASELINE_FILE = 'benchmark_baselines.json'
+
+# Quantiles recorded for every distribution.
+QUANTILES = [0.5, 0.9, 0.99]
+
+# Metrics are compared with this relative tolerance, absorbing floating point
+# differences from e.g. a changed summation order.
+METRIC_TOLERANCE = 1e-6
+
+# Stages faster than this many seconds are not flagged for run time, their timing is mostly noise.
+MIN_SECONDS = 0.05
+
+# Peak memory growth below this many bytes is not flagged.
+MIN_PEAK_BYTES = 2 ** 20
+
+# Printed throughput_graph value left out of the metrics, see throughput_metrics.
+UNTRACKED_THROUGHPUT = 'average_throughput'
+
+# Report script behind each kind of reference result.
+REPORTS = {'spineleaf': spineleaf, 'owcell': owcell}
+
+
+def quantiles(values):
+    """
+    quantiles returns the QUANTILES of a list of values as a dictionary.
+    """
+    if len(values) == 0:
+        return {}
+
+    return {'p%g' % (q * 100): float(v) for q, v in zip(QUANTILES, np.quantile(values, QUANTILES))}
+
+
+def cdf_quantiles(bin_edges, cdf):
+    """
+    cdf_quantiles returns the QUANTILES of a histogram CDF as the upper edge of
+    the first bin reaching each quantile.
+    """
+    if len(cdf) == 0 or not np.isfinite(cdf[-1]):
+        return {}
+    index = np.minimum(np.searchsorted(cdf, QUANTILES), len(cdf) - 1)
+
+    return {'p%g' % (q * 100): float(bin_edges[1:][i]) for q, i in zip(QUANTILES, index)}
+
+
+def vector_metrics(connection, vector_name, module_like=None, bins=100, processes=1):
+    """
+    vector_metrics aggregates every value of a vector, returning its count,
+    mean, minimum, maximum and CDF quantiles.
+    """
+    ids = vector_aggregation.vector_ids(connection, vector_name, module_like)
+    partials = vector_aggregation.parallel_aggregate_vectors(connection, ids, processes, bins=bins, time_bins=1)
+    totals = partials.totals()
+    count = totals['count']
+    hist = totals['hist']
+
+    return {'count': count, 'mean': totals['sum'] / count if count else None,
+            'min': totals['min'], 'max': totals['max'],
+            'cdf': cdf_quantiles(partials.bin_edges, np.cumsum(hist) / hist.sum() if count else [])}
+
+
+def drop_metrics(scalars):
+    """
+    drop_metrics keeps the packet counts and drop counts of a collect_utilization
+    or collect_scalars dictionary, along with the average utilizations.
+    """
+    metrics = {key: value for key, value in scalars.items() if key.startswith('pd_') or key.endswith('_count')}
+    for key in ['utilizations', 'spine_utilizations', 'leaf_utilizations']:
+        if key in scalars:
+            values = scalars[key]
+            metrics['average_' + key] = sum(values) / len(values) if values else None
+            metrics[key] = quantiles(values)
+
+    return metrics
+
+
+def flow_metrics(flows, totals):
+    """
+    flow_metrics keeps the flow count, the totals listed in totals and the
+    quantiles of the flow sizes, lengths and rates.
+    """
+    metrics = {key: flows[key] for key in totals}
+    metrics['flows'] = len(flows['sizes_list'])
+    for key in ['sizes_list', 'lengths_list', 'rates_list']:
+        metrics[key[:-5]] = quantiles(flows[key])
+
+    return metrics
+
+
+def throughput_metrics(vec, sca, options):
+    # throughput_graph only prints its results, the printed values are the metrics.
+    # Its average throughput scales with the square of the packet count rather than
+    # measuring a rate, so it is left out instead of being frozen into the baseline.
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        spineleaf.throughput_graph(vec)
+    metrics = {}
+    for line in output.getvalue().splitlines():
+        name, _, value = line.partition(': ')
+        name = re.sub(r'\W+', '_', name.strip().lower()).strip('_')
+        if name.startswith(UNTRACKED_THROUGHPUT):
+            continue
+        try:
+            metrics[name] = float(value)
+        except ValueError:
+            pass
+
+    return metrics
+
+
+def traffic_matrix_metrics(vec, sca, options):
+    info = run_info.run_info(vec)
+    cells = (info.rows or 0) * (info.columns or 0)
+    matrix, time_edges = traffic_matrix.build_traffic_matrix(vec, cells * (info.racks or 0), info.racks or 1,
+                                                             options['windows'])
+    hot = traffic_matrix.hot_spots(matrix, time_edges, top=1)
+
+    return {'total_bytes': float(matrix.sum()), 'windows': [float(total) for total in matrix.sum(axis=(1, 2))],
+            'hottest_bytes': max((spot[4] for spot in hot), default=0.0)}
+
+
+def traffic_matrix_graphics(vec, sca, options):
+    info = run_info.run_info(vec)
+    owcell.traffic_matrix_graphics(vec, (info.rows or 0) * (info.columns or 0), info.racks or 1, options['windows'])
+
+
+def figures(function):
+    # Stage writing figures, flushed so that encoding and writing are part of the time.
+    def stage(vec, sca, options):
+        function(vec, sca, options)
+        errors = figure_output.flush()
+        plt.close('all')
+        return {'figure_errors': len(errors)}
+
+    return stage
+
+
+# Stages per kind of reference result, called with the vector and scalar
+# connections and the options, and returning a dictionary of metrics.
+STAGES = {
+    'spineleaf': {
+        'collect_utilization': lambda vec, sca, options: drop_metrics(spineleaf.collect_utilization(sca)),
+        'collect_traffic': lambda vec, sca, options: flow_metrics(spineleaf.collect_traffic(sca),
+                                                                  ['intra_leaf', 'extra_leaf']),
+        'throughput': throughput_metrics,
+        'delay': lambda vec, sca, options: vector_metrics(vec, 'endToEndDelay:vector', '%]',
+                                                          processes=options['processes']),
+        'attribute_table': figures(lambda vec, sca, options: spineleaf.attribute_table(sca)),
+        'traffic_graphics': figures(lambda vec, sca, options: spineleaf.traffic_graphics(sca)),
+        'utilization_and_drop_graphics': figures(
+            lambda vec, sca, options: spineleaf.utilization_and_drop_graphics(sca)),
+        'throughput_and_delay_graphics': figures(
+            lambda vec, sca, options: spineleaf.throughput_and_delay_graphics(vec, options['processes'])),
+    },
+    'owcell': {
+        'collect_scalars': lambda vec, sca, options: drop_metrics(owcell.collect_scalars(sca)),
+        'collect_flows': lambda vec, sca, options: flow_metrics(owcell.collect_flows(vec),
+                                                                ['intra_cell', 'extra_cell',
+                                                                 'intra_rack', 'extra_rack']),
+        'packet_sizes': lambda vec, sca, options: vector_metrics(vec, 'txPk:vector(packetBytes)',
+                                                                 processes=options['processes']),
+        'traffic_matrix': traffic_matrix_metrics,
+        'distribution_graphics': figures(lambda vec, sca, options: owcell.distribution_graphics(vec)),
+        'heatmap_graphics': figures(lambda vec, sca, options: owcell.heatmap_graphics(vec)),
+        'traffic_matrix_graphics': figures(traffic_matrix_graphics),
+        'info_tables': figures(lambda vec, sca, options: owcell.info_tables(vec)),
+        'packet_size_cdf': figures(
+            lambda vec, sca, options: owcell.packet_size_cdf(vec, processes=options['processes'])),
+        'utilization_and_drop_graphics': figures(
+            lambda vec, sca, options: owcell.utilization_and_drop_graphics(sca)),
+    },
+}
+
+
+def positive_int(text):
+    """
+    positive_int is an argparse type for counts that must be at least 1.
+    """
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('%r is not an integer' % text)
+    if value < 1:
+        raise argparse.ArgumentTypeError('the count must be at least 1, got %s' % text)
+
+    return value
+
+
+def flatten(metrics, prefix=''):
+    """
+    flatten turns nested metric dictionaries and lists into a flat dictionary
+    of dotted names to numbers, e.g. {'sizes': {'p50': 1}} -> {'sizes.p50': 1}.
+    """
+    flat = {}
+    items = metrics.items() if isinstance(metrics, dict) else enumerate(metrics)
+    for key, value in items:
+        name = '%s%s' % (prefix, key)
+        if isinstance(value, (dict, list, tuple)):
+            flat.update(flatten(value, name + '.'))
+        elif value is None:
+            flat[name] = None
+        else:
+            flat[name] = float(value)
+
+    return flat
+
+
+def _clear_caches():
+    # Results memoized per file would make every run after the first one cheaper.
+    run_info._cache.clear()
+    param_values._cache.clear()
+
+
+def run_stage(stage, reference, options):
+    """
+    run_stage is used to measure one stage on a reference result, opening fresh
+    connections and clearing memoized results before every run.
+
+    The stage is run options['repeat'] times for its median time and once more
+    under tracemalloc for its peak memory, tracing slows it down too much to time
+    both at once. Memory of worker processes is not included, which is why the
+    stages default to a single process.
+
+    Returns a dictionary of seconds, times, peak_bytes and the flattened metrics.
+    """
+    report = REPORTS[reference['kind']]
+    times = []
+    metrics = None
+    for run in range(options['repeat'] + 1):
+        _clear_caches()
+        gc.collect()
+        vec = report.create_connection(reference['vec'])
+        sca = report.create_connection(reference['sca'])
+        traced = run == options['repeat']
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                metrics = stage(vec, sca, options)
+        finally:
+            seconds = time.perf_counter() - start
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            vec.close()
+            sca.close()
+        if not traced:
+            times.append(seconds)
+
+    return {'seconds': statistics.median(times), 'times': times, 'peak_bytes': peak, 'metrics': flatten(metrics)}
+
+
+def run_stages(references, options, selected=None, names=None):
+    """
+    run_stages runs every stage of the kinds in references whose name
+    ('kind.stage') starts with one of selected, or is one of names, returning a
+    dictionary of stage name to results. A failing stage is reported with its error.
+    """
+    results = {}
+    for kind, reference in references.items():
+        for name, stage in STAGES[kind].items():
+            name = '%s.%s' % (kind, name)
+            if selected and not any(name.startswith(prefix) for prefix in selected):
+                continue
+            if names is not None and name not in names:
+                continue
+            try:
+                results[name] = run_stage(stage, dict(reference, kind=kind), options)
+                print('%-50s %9.3f s %9.1f MiB' % (name, results[name]['seconds'],
+                                                   results[name]['peak_bytes'] / 2 ** 20))
+            except Exception as e:
+                print('%-50s failed: %s' % (name, e))
+                results[name] = {'error': str(e)}
+
+    return results
+
+
+def _slower(base, result, threshold):
+    return result['seconds'] > max(base['seconds'], MIN_SECONDS) * (1 + threshold)
+
+
+def confirm_slower(baseline, results, references, options, threshold, retries):
+    """
+    confirm_slower runs the stages that look slower than their baseline again up to
+    retries times, keeping the fastest median of the trials. Only a stage that is
+    slower in every trial is left slower in results.
+    """
+    for retry in range(retries):
+        slow = [name for name, result in results.items()
+                if 'error' not in result and name in baseline and 'error' not in baseline[name]
+                and _slower(baseline[name], result, threshold)]
+        if not slow:
+            return
+        print('Running %d slower stage(s) again to confirm' % len(slow))
+        for name, result in run_stages(references, options, names=slow).items():
+            if 'error' not in result and result['seconds'] < results[name]['seconds']:
+                results[name]['seconds'] = result['seconds']
+                results[name]['times'] = result['times']
+
+
+def _drifted(baseline, current):
+    if baseline is None or current is None:
+        return baseline is not current
+    if math.isnan(baseline) or math.isnan(current):
+        return math.isnan(baseline) != math.isnan(current)
+
+    return not math.isclose(baseline, current, rel_tol=METRIC_TOLERANCE, abs_tol=1e-12)
+
+
+def compare(baseline, current, threshold):
+    """
+    compare is used to find the regressions of current stage results against the
+    baseline ones, returning a list of messages (empty when nothing regressed).
+
+    A stage regresses when it fails, when its time or peak memory grew by more than
+    threshold (0.2 is 20%), or when a metric changed, appeared or disappeared.
+    """
+    problems = []
+    for name, result in current.items():
+        if 'error' in result:
+            problems.append('%s: failed: %s' % (name, result['error']))
+            continue
+        if name not in baseline or 'error' in baseline[name]:
+            problems.append('%s: no baseline recorded' % name)
+            continue
+        base = baseline[name]
+        if _slower(base, result, threshold):
+            problems.append('%s: time %.3f s -> %.3f s (%+.0f%%)'
+                            % (name, base['seconds'], result['seconds'],
+                               (result['seconds'] / base['seconds'] - 1) * 100))
+        if result['peak_bytes'] > max(base['peak_bytes'] * (1 + threshold), base['peak_bytes'] + MIN_PEAK_BYTES):
+            problems.append('%s: peak memory %.1f MiB -> %.1f MiB'
+                            % (name, base['peak_bytes'] / 2 ** 20, result['peak_bytes'] / 2 ** 20))
+        for metric in sorted(set(base['metrics']) | set(result['metrics'])):
+            if metric not in result['metrics']:
+                problems.append('%s: metric %s missing' % (name, metric))
+            elif metric not in base['metrics']:
+                problems.append('%s: metric %s not in baseline' % (name, metric))
+            elif _drifted(base['metrics'][metric], result['metrics'][metric]):
+                problems.append('%s: metric %s %r -> %r' % (name, metric, base['metrics'][metric],
+                                                             result['metrics'][metric]))
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record or check report benchmarks against stored baselines.')
+    parser.add_argument('command', choices=['record', 'check'],
+                        help='record new baselines or check the current code against them')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline JSON file')
+    parser.add_argument('--spineleaf', nargs=2, metavar=('VEC', 'SCA'),
+                        help='spine-leaf reference results (default: the ones in the baseline)')
+    parser.add_argument('--owcell', nargs=2, metavar=('VEC', 'SCA'),
+                        help='optical wireless cell reference results (default: the ones in the baseline)')
+    parser.add_argument('--stages', nargs='*', help="only run stages starting with these, e.g. 'owcell.collect'")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative increase of time and peak memory (default 0.2)')
+    parser.add_argument('--repeat', type=positive_int, default=5, help='timed runs per stage, the median is kept')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='times a stage that looks slower is run again before it is flagged')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes for vectorData scans')
+    parser.add_argument('--windows', type=int, default=10, help='time windows of the traffic matrix')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    references = dict(baseline.get('references', {}))
+    for kind in REPORTS:
+        if getattr(args, kind):
+            vec, sca = getattr(args, kind)
+            references[kind] = {'vec': vec, 'sca': sca}
+    if not references:
+        parser.error('no reference results given and none recorded in %s' % args.baseline)
+    if args.command == 'check' and not baseline:
+        parser.error('no baseline recorded in %s' % args.baseline)
+
+    options = dict(baseline.get('options', {}), repeat=args.repeat)
+    if args.command == 'record' or not baseline:
+        options.update(processes=args.processes, windows=args.windows)
+
+    # Figures go to a scratch directory, always encoded and written within the stage.
+    with tempfile.TemporaryDirectory() as directory:
+        figure_output.configure(directory=directory, skip_unchanged=False, workers=0)
+        results = run_stages(references, options, args.stages)
+        if args.command == 'check' and baseline:
+            confirm_slower(baseline['stages'], results, references, options, args.threshold, args.retries)
+        figure_output.reset()
+
+    if args.command == 'record':
+        stages = dict(baseline.get('stages', {}), **results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'references': references, 'options': options, 'machine': platform.platform(),
+                       'python': platform.python_version(), 'stages': stages}, f, indent=1, sort_keys=True)
+        failed = [name for name, result in results.items() if 'error' in result]
+        print('Recorded %d stages in %s' % (len(results) - len(failed), args.baseline))
+        return 1 if failed else 0
+
+    if baseline.get('machine') != platform.platform():
+        print('Baseline recorded on %s, timings may not be comparable' % baseline.get('machine'))
+    problems = compare(baseline['stages'], results, args.threshold)
+    for problem in problems:
+        print(problem)
+    print('%d regression(s) in %d stages' % (len(problems), len(results)))
+
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
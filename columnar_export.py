@@ -0,0 +1,300 @@
+"""
+columnar_export.py
+
+This file converts OMNeT++ SQLite results files into a directory of
+columnar Parquet files and loads them back for the report scripts.
+
+Module, vector, statistic and parameter names are dictionary encoded and
+every file is zstd compressed, which makes the archived results much smaller
+than the raw SQLite and avoids decoding the same strings row by row.
+
+The report collectors read the columns they need straight from Parquet
+with read_table. For everything else the run, runAttr, runParam, scalar and
+vector tables are loaded into an in-memory SQLite connection so the existing
+queries work unchanged, each one only once a query first mentions it.
+vectorData is never loaded, vector_aggregation reads it straight from the
+Parquet row groups.
+
+Usage:
+python columnar_export.py results.vec [output_directory]
+"""
+import argparse
+import os
+import re
+import sqlite3
+from urllib.request import pathname2url
+import numpy as np
+import pandas as pd
+
+
+# Tables converted by export_results, vectorData must stay last as it is by far the largest.
+EXPORT_TABLES = ['run', 'runAttr', 'runParam', 'scalar', 'vector', 'vectorData']
+
+# Columns holding heavily repeated strings.
+DICTIONARY_COLUMNS = ['runName', 'attrName', 'attrValue', 'paramKey', 'moduleName',
+                      'scalarName', 'vectorName']
+
+# Rows written per Parquet row group.
+ROW_GROUP_ROWS = 2 ** 20
+
+COMPRESSION = 'zstd'
+
+# Metric of each scalar the reports count, assigned by the first scalarName substring found in it.
+SCALAR_COUNTS = [
+    ('utilizations', 'rx channel utilization'), ('transfer_count', 'txPk:count'),
+    ('receive_count', 'rxPkOk:count'), ('pd_bad_checksum', 'droppedPkBadChecksum:count'),
+    ('pd_wrong_port', 'droppedPkWrongPort:count'),
+    ('pd_address_resolution_failed', 'packetDropAddressResolutionFailed:count'),
+    ('pd_forwarding_disabled', 'packetDropForwardingDisabled:count'),
+    ('pd_hop_limit_reached', 'packetDropHopLimitReached:count'),
+    ('pd_incorrectly_received', 'packetDropIncorrectlyReceived:count'),
+    ('pd_interface_down', 'packetDropInterfaceDown:count'),
+    ('pd_no_interface_found', 'packetDropNoInterfaceFound:count'),
+    ('pd_no_route_found', 'packetDropNoRouteFound:count'),
+    ('pd_not_addressed_to_us', 'packetDropNotAddressedToUs:count'),
+    ('pd_queue_overflow', 'packetDropQueueOverflow:count'),
+    ('pd_undefined', 'packetDropUndefined:count'),
+]
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('pyarrow is required for columnar results, install it with "pip install pyarrow"') from e
+
+    return pa, pq
+
+
+def is_columnar(path):
+    """
+    is_columnar returns True if path is a directory written by export_results.
+    """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'run.parquet'))
+
+
+def _arrow_schema(connection, table):
+    pa, pq = _pyarrow()
+    types = {'INTEGER': pa.int64(), 'REAL': pa.float64()}
+    fields = []
+    for row in connection.execute('PRAGMA table_info(%s)' % table):
+        fields.append(pa.field(row[1], types.get(row[2].upper(), pa.string())))
+
+    return pa.schema(fields)
+
+
+def export_results(connection, out_dir, row_group_rows=ROW_GROUP_ROWS):
+    """
+    export_results is used to write the tables of an OMNeT++ results connection
+    into out_dir as dictionary encoded, zstd compressed Parquet files.
+
+    Tables are streamed with fetchmany so vectorData is never held in memory.
+    """
+    pa, pq = _pyarrow()
+    os.makedirs(out_dir, exist_ok=True)
+    existing = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+    for table in EXPORT_TABLES:
+        if table not in existing:
+            continue
+        schema = _arrow_schema(connection, table)
+        dictionary = [name for name in schema.names if name in DICTIONARY_COLUMNS]
+        cur = connection.execute('SELECT %s FROM %s ORDER BY rowid' % (','.join(schema.names), table))
+        with pq.ParquetWriter(os.path.join(out_dir, table + '.parquet'), schema,
+                              compression=COMPRESSION, use_dictionary=dictionary or False) as writer:
+            while True:
+                rows = cur.fetchmany(row_group_rows)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                writer.write_table(pa.table([pa.array(columns[i], type=field.type) for i, field in enumerate(schema)],
+                                            schema=schema), row_group_size=row_group_rows)
+
+
+class ColumnarCursor(sqlite3.Cursor):
+    """
+    ColumnarCursor loads the tables a statement mentions before running it.
+    """
+
+    def execute(self, sql, parameters=()):
+        self.connection._load_tables(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.connection._load_tables(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        self.connection._load_tables(sql_script)
+        return super().executescript(sql_script)
+
+
+class ColumnarConnection(sqlite3.Connection):
+    """
+    ColumnarConnection is an in-memory SQLite connection holding the small tables
+    of an exported result, with columnar_path pointing at the Parquet directory.
+
+    Tables are loaded from Parquet the first time a statement mentions them, so
+    opening a result costs nothing until it is queried. Every statement goes
+    through a ColumnarCursor, whether it is run on the connection or a cursor.
+    """
+    columnar_path = None
+
+    def cursor(self, factory=ColumnarCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def _load_tables(self, sql):
+        pa, pq = _pyarrow()
+        loaded = self.__dict__.setdefault('_loaded', set())
+        # A plain cursor, so loading a table does not go through _load_tables again.
+        cur = sqlite3.Cursor(self)
+        for table in EXPORT_TABLES[:-1]:
+            if table in loaded or not re.search(r'\b%s\b' % table, sql):
+                continue
+            loaded.add(table)
+            filename = os.path.join(self.columnar_path, table + '.parquet')
+            if not os.path.exists(filename):
+                continue
+            data = pq.read_table(filename)
+            cur.execute('CREATE TABLE %s (%s)' % (table, ', '.join(data.schema.names)))
+            cur.executemany('INSERT INTO %s VALUES (%s)' % (table, ','.join('?' * data.num_columns)),
+                            zip(*(column.to_pylist() for column in data.columns)))
+        cur.close()
+        self.commit()
+
+
+def load_columnar(path):
+    """
+    load_columnar opens a directory written by export_results and returns a
+    ColumnarConnection that the report functions can query like the original file.
+    """
+    _pyarrow()
+    con = sqlite3.connect(':memory:', factory=ColumnarConnection)
+    con.columnar_path = path
+
+    return con
+
+
+def table_names(connection):
+    """
+    table_names returns the set of tables that can be queried on connection,
+    including the ones a ColumnarConnection has not loaded yet.
+    """
+    columnar_path = getattr(connection, 'columnar_path', None)
+    if columnar_path:
+        return {name[:-len('.parquet')] for name in os.listdir(columnar_path) if name.endswith('.parquet')}
+
+    return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def read_table(connection, table, columns):
+    """
+    read_table returns columns of table as a pandas DataFrame in rowid order,
+    read straight from Parquet for a ColumnarConnection and with a single query
+    otherwise.
+    """
+    columnar_path = getattr(connection, 'columnar_path', None)
+    if columnar_path:
+        pa, pq = _pyarrow()
+        filename = os.path.join(columnar_path, table + '.parquet')
+        if not os.path.exists(filename):
+            return pd.DataFrame(columns=columns)
+        return pq.read_table(filename, columns=columns).to_pandas()
+
+    rows = connection.execute('SELECT %s FROM %s' % (','.join(columns), table)).fetchall()
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+def scalar_categories(names):
+    """
+    scalar_categories returns the position in SCALAR_COUNTS of every scalarName in
+    names (-1 when none applies), matching each distinct name only once.
+    """
+    codes, unique = pd.factorize(names)
+    categories = np.array([next((i for i, (_, pattern) in enumerate(SCALAR_COUNTS) if pattern in str(name)), -1)
+                           for name in unique] + [-1], dtype=np.int64)
+
+    return categories[codes]
+
+
+def simtime_exponent(path):
+    """
+    simtime_exponent returns the simtimeExp of the first run of an exported result
+    without loading any other table.
+    """
+    pa, pq = _pyarrow()
+
+    return pq.read_table(os.path.join(path, 'run.parquet'), columns=['simtimeExp']).column(0)[0].as_py()
+
+
+def vector_data_rows(path):
+    """
+    vector_data_rows returns the number of rows in the exported vectorData.
+    """
+    pa, pq = _pyarrow()
+    filename = os.path.join(path, 'vectorData.parquet')
+    if not os.path.exists(filename):
+        return 0
+
+    return pq.ParquetFile(filename).metadata.num_rows
+
+
+def iter_vector_data(path, ids, chunk_rows, ranges):
+    """
+    iter_vector_data reads the exported vectorData row group by row group and
+    yields (vector_ids, simtimeRaw, values) numpy arrays for the rows of ids.
+
+    ranges is a list of (first_row, last_row) pairs of row positions, the columnar
+    counterpart of the rowid ranges used for SQLite files.
+    """
+    pa, pq = _pyarrow()
+    parquet_file = pq.ParquetFile(os.path.join(path, 'vectorData.parquet'))
+    wanted = np.asarray(ids, dtype=np.int64)
+
+    # Row position where each row group starts.
+    starts = np.cumsum([0] + [parquet_file.metadata.row_group(i).num_rows
+                              for i in range(parquet_file.num_row_groups)])
+
+    for first, last in ranges:
+        for group in range(parquet_file.num_row_groups):
+            group_first, group_end = starts[group], starts[group + 1]
+            if group_end <= first or group_first > last:
+                continue
+            data = parquet_file.read_row_group(group, columns=['vectorId', 'simtimeRaw', 'value'])
+            lo = max(first, group_first) - group_first
+            hi = min(last + 1, group_end) - group_first
+            for chunk_lo in range(lo, hi, chunk_rows):
+                chunk = data.slice(chunk_lo, min(chunk_rows, hi - chunk_lo))
+                vector_ids = chunk.column('vectorId').to_numpy()
+                keep = np.isin(vector_ids, wanted)
+                if not keep.any():
+                    continue
+                yield (vector_ids[keep],
+                       chunk.column('simtimeRaw').to_numpy().astype(np.int64)[keep],
+                       chunk.column('value').to_numpy()[keep])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert OMNeT++ SQLite results into columnar Parquet files.')
+    parser.add_argument('database', help='OMNeT++ .sca or .vec SQLite results file')
+    parser.add_argument('output', nargs='?', help='output directory, defaults to <database>.columnar')
+    args = parser.parse_args()
+
+    con = sqlite3.connect('file:%s?mode=ro' % pathname2url(args.database), uri=True)
+    export_results(con, args.output or args.database + '.columnar')
+    con.close()
+
+
+if __name__ == '__main__':
+    main()
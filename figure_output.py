@@ -0,0 +1,310 @@
+"""
+figure_output.py
+
+This file writes the report figures without holding up the report.
+
+savefig takes a snapshot of the figure, along with the rcParams in effect,
+and hands it to background worker processes, so the report carries on while
+images are encoded. Encoding happens in separate processes because
+matplotlib is not thread safe: drawing while another thread saves (or
+changing rcParams, e.g. with sns.set) breaks both. Encoded files are written
+as they complete and at the latest on flush.
+Each figure can be written in several formats (PNG, SVG, PDF) at its own DPI,
+optionally with a low resolution thumbnail for sweep dashboards. A manifest
+keeps the hash of every figure snapshot, along with the options and rcParams
+it was saved with, and of the file encoded from it. Figures whose input is
+unchanged since the last write are not encoded again, and files whose output
+is unchanged are not written again. At most MAX_PENDING_PER_WORKER figures per
+worker wait to be encoded, savefig blocks on the oldest beyond that.
+
+Usage:
+figure_output.configure(directory='out', formats=['png', 'svg'], thumbnail_dpi=30)
+figure_output.savefig('flow_size_cdf.png')
+figure_output.flush()
+"""
+import atexit
+import gc
+import hashlib
+import io
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.transforms import TransformNode
+
+
+# Name of the file in the output directory recording the input and output hash of every written file.
+MANIFEST = '.figure_hashes.json'
+
+# Figures queued per encoding process before savefig waits for the oldest.
+MAX_PENDING_PER_WORKER = 2
+
+# Metadata left out of each format so unchanged figures encode to identical bytes.
+STABLE_METADATA = {'svg': {'Date': None}, 'pdf': {'CreationDate': None}}
+
+# Subdirectory of the output directory holding thumbnails.
+THUMBNAIL_DIRECTORY = 'thumbnails'
+
+# rcParams not passed on to the worker processes.
+LOCAL_RCPARAMS = ['backend', 'backend_fallback', 'interactive']
+
+DEFAULT_SETTINGS = {
+    'directory': '.',
+    'formats': None,        # None keeps the extension of the requested file name.
+    'dpi': None,            # None uses matplotlib's savefig.dpi.
+    'thumbnail_dpi': None,  # None writes no thumbnails.
+    'skip_unchanged': True,
+    'overrides': {},        # Per figure options, {'traffic_between_racks': {'formats': ['svg'], 'dpi': 200}}.
+}
+
+_settings = dict(DEFAULT_SETTINGS)
+_workers = 1
+_pool = None
+_pending = []
+_manifest = None
+_manifest_changed = False
+_errors = []
+
+
+def configure(directory=None, formats=None, dpi=None, thumbnail_dpi=None, skip_unchanged=None,
+              overrides=None, workers=None):
+    """
+    configure sets where and how figures are written, pending figures are flushed first.
+
+    formats is a list of extensions such as ['png', 'pdf'], overrides maps a figure
+    name without extension to its own formats, dpi and thumbnail_dpi. workers is the
+    number of encoding processes, 0 encodes every figure within savefig.
+    """
+    global _manifest, _workers, _pool
+    flush()
+    if workers is not None and workers != _workers:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+        _workers = workers
+    for key, value in [('directory', directory), ('formats', formats), ('dpi', dpi),
+                       ('thumbnail_dpi', thumbnail_dpi), ('skip_unchanged', skip_unchanged),
+                       ('overrides', overrides)]:
+        if value is not None:
+            _settings[key] = value
+    _manifest = None
+    # SVG element ids are random unless salted, which would defeat the unchanged check.
+    if plt.rcParams['svg.hashsalt'] is None:
+        plt.rcParams['svg.hashsalt'] = 'figure_output'
+
+
+def reset():
+    """
+    reset flushes pending figures and restores the default settings, so nothing
+    more is written to the previously configured directory.
+    """
+    global _manifest, _workers, _pool
+    flush()
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+    _workers = 1
+    _settings.clear()
+    _settings.update(DEFAULT_SETTINGS, overrides={})
+    _manifest = None
+
+
+def add_arguments(parser):
+    """
+    add_arguments adds the figure output options of the reports to an argparse parser,
+    to be passed to configure_from_args once parsed.
+    """
+    parser.add_argument('--output', default='.', help='directory to write the figures to')
+    parser.add_argument('--formats', help='comma separated figure formats, e.g. png,svg,pdf')
+    parser.add_argument('--dpi', type=float, help='resolution of the figures')
+    parser.add_argument('--thumbnail-dpi', type=float, help='also write PNG thumbnails at this resolution')
+    parser.add_argument('--rewrite', action='store_true', help='write figures even when unchanged')
+
+
+def configure_from_args(args):
+    """
+    configure_from_args configures the output from options added by add_arguments.
+    """
+    configure(directory=args.output, formats=args.formats.split(',') if args.formats else None,
+              dpi=args.dpi, thumbnail_dpi=args.thumbnail_dpi, skip_unchanged=not args.rewrite)
+
+
+def _load_manifest():
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(os.path.join(_settings['directory'], MANIFEST)) as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+class _StablePickler(pickle.Pickler):
+    # Pickles equal figures to equal bytes, also across processes, so the snapshot
+    # doubles as the fingerprint of the figure. Transforms key their parents by id(),
+    # those are numbered by first appearance instead, sets are sorted and the pyplot
+    # figure number is left out.
+    def __init__(self, file):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self._ids = {}
+
+    def reducer_override(self, obj):
+        if isinstance(obj, (set, frozenset)):
+            try:
+                return type(obj), (sorted(obj),)
+            except TypeError:
+                return NotImplemented
+        if not isinstance(obj, (TransformNode, Figure)):
+            return NotImplemented
+        reduced = list(obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL))
+        state = dict(reduced[2])
+        if isinstance(obj, TransformNode):
+            state['_parents'] = {self._ids.setdefault(key, len(self._ids)): parent
+                                 for key, parent in state['_parents'].items() if parent is not None}
+        else:
+            state.pop('_number', None)
+        reduced[2] = state
+        return tuple(reduced)
+
+
+def _snapshot(fig):
+    # Pickle the figure without its pyplot manager so the copy is not registered with pyplot.
+    # Cleared artists can linger as parents of its transforms until they are collected,
+    # collect them first so they are neither pickled nor change the fingerprint.
+    gc.collect()
+    manager = fig.canvas.manager
+    fig.canvas.manager = None
+    try:
+        buffer = io.BytesIO()
+        _StablePickler(buffer).dump(fig)
+        return buffer.getvalue()
+    finally:
+        fig.canvas.manager = manager
+
+
+def _unchanged(outputs, fingerprint):
+    # Whether every output was last written from the same input and is still there.
+    manifest = _load_manifest()
+    for path, _, _ in outputs:
+        entry = manifest.get(os.path.relpath(path, _settings['directory']))
+        if not isinstance(entry, dict) or entry.get('input') != fingerprint or not os.path.exists(path):
+            return False
+
+    return True
+
+
+def savefig(name, fig=None, formats=None, dpi=None, thumbnail_dpi=None, **kwargs):
+    """
+    savefig is used in place of plt.savefig to queue the current figure (or fig)
+    to be written as name in the configured output directory.
+
+    The figure is copied immediately, so it can be cleared or changed right after
+    this returns, and is not encoded at all when neither it nor its options changed
+    since it was last written. Remaining keyword arguments are passed on to Figure.savefig.
+    """
+    global _pool
+    fig = fig or plt.gcf()
+    base, extension = os.path.splitext(name)
+    options = _settings['overrides'].get(base, {})
+    formats = formats or options.get('formats') or _settings['formats'] or [extension.lstrip('.') or 'png']
+    dpi = dpi or options.get('dpi') or _settings['dpi']
+    thumbnail_dpi = thumbnail_dpi or options.get('thumbnail_dpi') or _settings['thumbnail_dpi']
+
+    paths = [os.path.join(_settings['directory'], '%s.%s' % (base, fmt)) for fmt in formats]
+    if thumbnail_dpi:
+        paths.append(os.path.join(_settings['directory'], THUMBNAIL_DIRECTORY, base + '.png'))
+        formats = list(formats) + ['png']
+    dpis = [dpi] * (len(paths) - bool(thumbnail_dpi)) + ([thumbnail_dpi] if thumbnail_dpi else [])
+
+    outputs = list(zip(paths, formats, dpis))
+
+    snapshot = _snapshot(fig)
+    rc = {key: value for key, value in plt.rcParams.items() if key not in LOCAL_RCPARAMS}
+    fingerprint = hashlib.sha1(snapshot)
+    fingerprint.update(repr((outputs, sorted(kwargs.items()), sorted(rc.items()))).encode())
+    fingerprint = fingerprint.hexdigest()
+    if _settings['skip_unchanged'] and _unchanged(outputs, fingerprint):
+        return
+
+    if _workers == 0:
+        _write(_encode(snapshot, outputs, kwargs), fingerprint)
+        return
+    if _pool is None:
+        _pool = ProcessPoolExecutor(_workers)
+    _pending.append((_pool.submit(_encode, snapshot, outputs, kwargs, rc), fingerprint))
+    _write_completed(limit=MAX_PENDING_PER_WORKER * _workers)
+
+
+def _encode(snapshot, outputs, kwargs, rc=None):
+    # Runs in a worker process, returns the encoded [(path, bytes)] of one figure.
+    with matplotlib.rc_context(rc):
+        fig = pickle.loads(snapshot)
+        encoded = []
+        for path, fmt, dpi in outputs:
+            options = dict(kwargs)
+            if dpi:
+                options['dpi'] = dpi
+            if fmt in STABLE_METADATA:
+                options.setdefault('metadata', STABLE_METADATA[fmt])
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format=fmt, **options)
+            encoded.append((path, buffer.getvalue()))
+
+    return encoded
+
+
+def _write(encoded, fingerprint):
+    global _manifest_changed
+    manifest = _load_manifest()
+    for path, data in encoded:
+        entry = {'input': fingerprint, 'output': hashlib.sha1(data).hexdigest()}
+        name = os.path.relpath(path, _settings['directory'])
+        previous = manifest.get(name)
+        if (_settings['skip_unchanged'] and isinstance(previous, dict)
+                and previous.get('output') == entry['output'] and os.path.exists(path)):
+            if previous != entry:
+                manifest[name] = entry
+                _manifest_changed = True
+            continue
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        manifest[name] = entry
+        _manifest_changed = True
+
+
+def _write_completed(wait=False, limit=None):
+    # Write the figures encoded so far, in the order they were saved, waiting
+    # for the oldest while more than limit are pending.
+    while _pending and (wait or _pending[0][0].done() or (limit is not None and len(_pending) > limit)):
+        future, fingerprint = _pending.pop(0)
+        try:
+            _write(future.result(), fingerprint)
+        except Exception as e:
+            _errors.append(e)
+            print(e)
+
+
+def flush():
+    """
+    flush waits until every queued figure has been written and saves the hash manifest.
+    Returns the errors raised while encoding or writing since the last flush.
+    """
+    global _manifest_changed
+    _write_completed(wait=True)
+    if _manifest_changed:
+        os.makedirs(_settings['directory'], exist_ok=True)
+        with open(os.path.join(_settings['directory'], MANIFEST), 'w') as f:
+            json.dump(_manifest, f, indent=1, sort_keys=True)
+        _manifest_changed = False
+    errors = list(_errors)
+    _errors.clear()
+
+    return errors
+
+
+atexit.register(flush)
@@ -0,0 +1,127 @@
+"""
+lod_heatmap.py
+
+This file provides multi-resolution traffic heatmaps for large topologies.
+
+A traffic matrix at the finest level (e.g. host to host) is pre-aggregated
+into coarser levels (rack, leaf, cell) by summing blocks. Every level is drawn
+with a single imshow raster instead of one patch per cell, tick labels are
+thinned out once there are too many to read, and any block of a coarse level
+can be drilled into to show the finer level inside it.
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.ticker import FixedFormatter, FixedLocator, MaxNLocator
+
+
+# Above this many rows a level is drawn without a label on every tick.
+MAX_LABELED_TICKS = 128
+
+
+def heat_matrix(heat_dict, groups, value=0):
+    """
+    heat_matrix converts a heat dictionary keyed by (from_group, from_member,
+    to_group, to_member) into a square matrix of the finest level, where group
+    and member are e.g. leaf and host or cell and rack.
+
+    groups is the number of members per group and value selects which entry of
+    the dictionary values to use.
+    """
+    if groups < 1:
+        raise ValueError('heat_matrix needs at least one member per group, got %r' % groups)
+    if not heat_dict:
+        return np.zeros((0, 0))
+    keys = np.array(list(heat_dict.keys()), dtype=np.int64)
+    values = np.array([entry[value] for entry in heat_dict.values()], dtype=np.float64)
+    sources = keys[:, 0] * groups + keys[:, 1]
+    destinations = keys[:, 2] * groups + keys[:, 3]
+    size = int(max(sources.max(), destinations.max())) + 1
+    size += -size % groups
+
+    matrix = np.zeros((size, size))
+    np.add.at(matrix, (sources, destinations), values)
+
+    return matrix
+
+
+def build_levels(matrix, levels):
+    """
+    build_levels is used to pre-aggregate a finest level matrix into every level.
+
+    levels is a list of (name, block) pairs ordered from coarse to fine, where block
+    is how many finest level rows make up one row of that level, e.g.
+    [('leaf', hosts), ('host', 1)]. The matrix is zero padded when it does not
+    divide evenly. Returns a dictionary of level name to matrix in the same order.
+    """
+    aggregated = {}
+    for name, block in levels:
+        size = -(-matrix.shape[0] // block)
+        padded = np.zeros((size * block, size * block))
+        padded[:matrix.shape[0], :matrix.shape[1]] = matrix
+        aggregated[name] = padded.reshape(size, block, size, block).sum(axis=(1, 3))
+
+    return aggregated
+
+
+def drill(aggregated, levels, level, from_block, to_block, finer=None):
+    """
+    drill returns the finer level matrix inside block (from_block, to_block) of level.
+
+    aggregated is the dictionary returned by build_levels for levels, the block is
+    sliced out of its finer level so nothing is aggregated again. finer defaults to
+    the level directly below level in levels.
+    """
+    names = [name for name, _ in levels]
+    blocks = dict(levels)
+    finer = finer or names[names.index(level) + 1]
+    ratio = blocks[level] // blocks[finer]
+
+    return aggregated[finer][from_block * ratio:(from_block + 1) * ratio, to_block * ratio:(to_block + 1) * ratio]
+
+
+def pick_level(aggregated, max_rows):
+    """
+    pick_level returns the name of the finest level with at most max_rows rows,
+    or the coarsest level when none fit.
+    """
+    fitting = [name for name, matrix in aggregated.items() if matrix.shape[0] <= max_rows]
+
+    return fitting[-1] if fitting else next(iter(aggregated))
+
+
+def render(matrix, ax=None, labels=None, cmap='hot_r', vmin=None, vmax=None, colorbar=True):
+    """
+    render draws a traffic matrix as a single raster image with sources along the
+    x axis and destinations along the y axis, matching the orientation of the
+    report heatmaps.
+
+    labels are used for the ticks of small matrices, larger ones get a limited
+    number of numeric ticks instead.
+    """
+    ax = ax or plt.gca()
+    image = ax.imshow(matrix.T, origin='lower', cmap=cmap, vmin=vmin, vmax=vmax,
+                      aspect='auto', interpolation='nearest')
+    ax.grid(False)
+    size = matrix.shape[0]
+    if labels is not None and size <= MAX_LABELED_TICKS:
+        # Locators and formatters instead of set_ticks, so the tick objects are only
+        # created when the figure is drawn rather than up front for every tick.
+        for axis in [ax.xaxis, ax.yaxis]:
+            axis.set_major_locator(FixedLocator(range(size)))
+            axis.set_major_formatter(FixedFormatter([str(label) for label in labels]))
+    else:
+        ax.xaxis.set_major_locator(MaxNLocator(16, integer=True))
+        ax.yaxis.set_major_locator(MaxNLocator(16, integer=True))
+    if colorbar:
+        ax.figure.colorbar(image, ax=ax)
+
+    return image
+
+
+def separate_blocks(ax, size, block):
+    """
+    separate_blocks draws lines every block rows, e.g. between the racks of different cells.
+    """
+    positions = np.arange(block, size, block) - 0.5
+    ax.hlines(positions, -0.5, size - 0.5, linewidth=0.5)
+    ax.vlines(positions, -0.5, size - 0.5, linewidth=0.5)
@@ -4,30 +4,44 @@ owcell_network_report.py
 This file will generate graphics for a given
 network configuration using OMNeT++ SQLite results files.
 
-TODO: Break up file into functions.
 TODO: Query the database files instead of iterating over them.
 
 Useful Links:
 https://docs.omnetpp.org/tutorials/pandas/
 https://docs.omnetpp.org/tutorials/tictoc/part6/
 """
+import argparse
 import sqlite3
 from sqlite3 import Error
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-import re
 import statistics
+import vector_aggregation
+import columnar_export
+import traffic_matrix
+import lod_heatmap
+import run_info
+import param_values
+import figure_output
+
+
+# Largest host to host matrix traffic_levels keeps, in rows (4096 rows take 128 MiB).
+MAX_HOST_ROWS = 4096
 
 
 def create_connection(db):
     """
     This function is utilized to connect to the OMNet++ results
-    file stored as a SQLite file.
+    file stored as a SQLite file, or to a columnar
+    export of it created with columnar_export.py.
     """
     con = None
     try:
+        # Directories written by columnar_export are loaded from Parquet.
+        if columnar_export.is_columnar(db):
+            return columnar_export.load_columnar(db)
         con = sqlite3.connect(db)
     except Error as e:
         print(e)
@@ -35,103 +49,238 @@ def create_connection(db):
     return con
 
 
-def main():
-    # Path for database to be opened.
-    vec_database = '/share/test-#3-large.owcell.vec'
-    sca_database = '/share/test-#3-large.owcell.sca'
+def collect_flows(vec_connection):
+    """
+    collect_flows is used to record the sizes sent and add up the time for each
+    flow configured in the runParam table.
 
-    # Create connection to database.
-    con = create_connection(vec_database)
+    The flow parameters come from param_values.flow_table, which parses whole
+    columns at once in any unit. Sizes are returned in MiB and lengths in seconds.
 
-    # Create cursor for querying runParam table,
-    #   this contains the flow information we will use.
-    # -------------------------------------------------------
-    # | runId   | paramKey  | paramValue    | paramOrder    |
-    # -------------------------------------------------------
-    cur = con.execute('SELECT * FROM runParam')
-
-    # Loop through the table and record the sizes sent
-    #   and add up the time for each flow.
-    info_rows = 0
-    info_cols = 0
-    info_racks = 0
-    info_hosts = 0
-    heat_dict = {}  # { (frm_cell, frm_rack, to_cell, to_rack) : ( size, length) }
+    Returns a dictionary of the flow lists, the heat dictionaries between racks and
+    between hosts and the intra/extra cell and rack totals.
+    """
+    flows = param_values.flow_table(vec_connection)
+    sizes = flows['sendBytes'] / 2 ** 20
+    lengths = 1 + flows['tOpen'] + flows['tSend'] + flows['tClose']
+
+    # Extract the cell, rack and host on both ends of every connection.
     pattern = '.*\[(\d*)\]\..*\[(\d*)\].*\[(\d*)\].*\[(\d*)\].*'
     pattern2 = '.*\[(\d*)\]\..*\[(\d*)\].*\[(\d*)\].*'
-    size = 0
-    sizes_list = []
-    lengths_list = []
-    rates_list = []
-    length = 1
-    intra_cell = 0
-    intra_rack = 0
-    extra_cell = 0
-    extra_rack = 0
-    for row in cur:
-        if 'sendBytes' in row[1]:
-            size = int(row[2][:-3])
-            sizes_list.append(size)
-        elif 'tOpen' in row[1]:
-            length = 1
-            length += int(row[2][:-1])
-        elif 'tSend' in row[1]:
-            length += int(row[2][:-1])
-        elif 'tClose' in row[1]:
-            length += int(row[2][:-1])
-
-            lengths_list.append(length)
-            rates_list.append(size / length)
-        elif 'connectAddress' in row[1]:
-            capture = re.search(pattern, row[1])
-
-            frm_cell = int(capture.group(1))
-            frm_rack = int(capture.group(2))
-
-            capture = re.search(pattern2, row[2])
-
-            to_cell = int(capture.group(1))
-            to_rack = int(capture.group(2))
-
-            if (frm_cell, frm_rack, to_cell, to_rack) in heat_dict:
-                old_size, old_len = heat_dict[(frm_cell, frm_rack, to_cell, to_rack)]
-                heat_dict[(frm_cell, frm_rack, to_cell, to_rack)] = (old_size + size, old_len + length)
-            else:
-                heat_dict[(frm_cell, frm_rack, to_cell, to_rack)] = (size, length)
-
-            if frm_cell == to_cell:
-                intra_cell += size
-            else:
-                extra_cell += size
-
-            if frm_cell == to_cell and frm_rack == to_rack:
-                intra_rack += size
-            else:
-                extra_rack += size
-        elif '**.rows' in row[1]:
-            info_rows = int(row[2])
-        elif '**.columns' in row[1]:
-            info_cols = int(row[2])
-        elif '**.racks' in row[1]:
-            info_racks = int(row[2])
-        elif '**.hosts' in row[1]:
-            info_hosts = int(row[2])
+    connected = flows[flows['connectAddress'].notna()]
+    capture = (connected.index.to_series() + '.connectAddress').str.extract(pattern)
+    capture2 = connected['connectAddress'].str.extract(pattern2)
+    keys = ['frm_cell', 'frm_rack', 'to_cell', 'to_rack']
+    host_keys = ['frm_cell', 'frm_rack', 'frm_host', 'to_cell', 'to_rack', 'to_host']
+    heat = pd.DataFrame({'frm_cell': capture[0], 'frm_rack': capture[1], 'frm_host': capture[2],
+                         'to_cell': capture2[0], 'to_rack': capture2[1], 'to_host': capture2[2],
+                         'size': sizes[connected.index], 'length': lengths[connected.index]}).dropna()
+    heat[host_keys] = heat[host_keys].astype(int)
 
-    # ----- Create and save plots -----
-    # ---------------------------------
+    # { (frm_cell, frm_rack, to_cell, to_rack) : ( size, length) }
+    totals = heat.groupby(keys)[['size', 'length']].sum()
+    heat_dict = dict(zip(totals.index.tolist(), zip(totals['size'].tolist(), totals['length'].tolist())))
+
+    # { (frm_cell, frm_rack, frm_host, to_cell, to_rack, to_host) : ( size, length) }
+    totals = heat.groupby(host_keys)[['size', 'length']].sum()
+    host_heat_dict = dict(zip(totals.index.tolist(), zip(totals['size'].tolist(), totals['length'].tolist())))
+
+    same_cell = heat['frm_cell'] == heat['to_cell']
+    same_rack = same_cell & (heat['frm_rack'] == heat['to_rack'])
+
+    # Flows without a positive length have no rate and are left out of the length and rate lists.
+    timed = np.isfinite(lengths) & (lengths > 0)
+
+    return {'heat_dict': heat_dict, 'host_heat_dict': host_heat_dict, 'sizes_list': sizes.tolist(), 'lengths_list': lengths[timed].tolist(),
+            'rates_list': (sizes[timed] / lengths[timed]).tolist(),
+            'intra_cell': heat.loc[same_cell, 'size'].sum(), 'extra_cell': heat.loc[~same_cell, 'size'].sum(),
+            'intra_rack': heat.loc[same_rack, 'size'].sum(), 'extra_rack': heat.loc[~same_rack, 'size'].sum()}
+
+
+def traffic_levels(heat_dict, cells, racks, hosts=None, host_heat_dict=None):
+    """
+    traffic_levels pre-aggregates the configured traffic between racks into
+    cell and rack level matrices, see lod_heatmap.build_levels.
+
+    When hosts (per rack) and the host_heat_dict of collect_flows are given, the
+    traffic between hosts is kept as a finer host level to drill into racks, as long
+    as it has no more than MAX_HOST_ROWS rows.
+    """
+    if hosts and host_heat_dict is not None and cells * racks * hosts <= MAX_HOST_ROWS:
+        # Hosts are numbered within their rack, racks across every cell.
+        by_rack = {}
+        for (frm_cell, frm_rack, frm_host, to_cell, to_rack, to_host), entry in host_heat_dict.items():
+            by_rack[(frm_cell * racks + frm_rack, frm_host, to_cell * racks + to_rack, to_host)] = entry
+        heats = lod_heatmap.heat_matrix(by_rack, hosts)
+        levels = [('cell', racks * hosts), ('rack', hosts), ('host', 1)]
+        size = cells * racks * hosts
+    else:
+        heats = lod_heatmap.heat_matrix(heat_dict, racks)
+        levels = [('cell', racks), ('rack', 1)]
+        size = cells * racks
+    matrix = np.zeros((size, size))
+    used = min(heats.shape[0], size)
+    matrix[:used, :used] = heats[:used, :used]
+
+    return lod_heatmap.build_levels(matrix, levels)
+
+
+def collect_scalars(sca_connection):
+    """
+    collect_scalars is used to gather the utilization and packet drop
+    information from the scalar table.
+
+    The scalar table is read in one go (straight from Parquet for columnar results)
+    and every scalar is assigned to the first entry of columnar_export.SCALAR_COUNTS
+    its name contains.
+    """
+    # -----------------------------------------------------------------------
+    # | scalarId   | runID  | moduleName    | scalarName    | scalarValue   |
+    # -----------------------------------------------------------------------
+    scalars = columnar_export.read_table(sca_connection, 'scalar', ['scalarName', 'scalarValue'])
+    keys = [key for key, _ in columnar_export.SCALAR_COUNTS]
+    category = columnar_export.scalar_categories(scalars['scalarName'])
+    values = scalars['scalarValue']
+
+    collected = {'utilizations': values[category == keys.index('utilizations')].tolist()}
+    for key, _ in columnar_export.SCALAR_COUNTS[1:]:
+        # Added up in row order like the per row loop this replaced, so totals match exactly.
+        collected[key] = sum(values[category == keys.index(key)].tolist(), 0)
+
+    return collected
+
+
+def aggregate_packet_sizes(vec_connection, memory_budget=vector_aggregation.DEFAULT_MEMORY_BUDGET, bins=10,
+                           processes=None):
+    """
+    aggregate_packet_sizes is used to aggregate the txPk:vector(packetBytes) vectors
+    from vectorData in rowid ranges so no more than memory_budget bytes are held at
+    once, with the scan split across processes worker processes.
+    """
+    ids = vector_aggregation.vector_ids(vec_connection, 'txPk:vector(packetBytes)')
+
+    return vector_aggregation.parallel_aggregate_vectors(vec_connection, ids, processes, memory_budget,
+                                                         bins=bins, time_bins=1)
+
+
+def packet_size_cdf(vec_connection, memory_budget=vector_aggregation.DEFAULT_MEMORY_BUDGET, bins=10,
+                    processes=None, preview=None, partials=None):
+    """
+    packet_size_cdf creates a CDF of the size of every transferred packet.
+
+    partials can be passed in when the results of aggregate_packet_sizes are
+    already at hand, otherwise vectorData is scanned for them.
+
+    When preview is set to a fraction the CDF is estimated from that share of
+    vectorData, drawn with its 95% confidence band and saved as approximate.
+    """
+    if preview:
+        ids = vector_aggregation.vector_ids(vec_connection, 'txPk:vector(packetBytes)')
+        estimate = vector_aggregation.preview_vectors(vec_connection, ids, preview, bins=bins, time_bins=1)
+        cdf, cdf_error = estimate['cdf']
+        bin_edges = estimate['bin_edges']
+
+        plt.plot(bin_edges[1:], cdf, label='Packet Size CDF')
+        plt.fill_between(bin_edges[1:], cdf - cdf_error, cdf + cdf_error, alpha=0.3)
+        plt.title('Packet Size CDF (approximate, %.1f%% sample)' % (estimate['fraction'] * 100))
+        plt.xlabel('Packet Size (in bytes)')
+        plt.ylabel('CDF')
+        figure_output.savefig('packet_size_cdf_preview.png')
+        plt.clf()
+        return
+
+    if partials is None:
+        partials = aggregate_packet_sizes(vec_connection, memory_budget, bins, processes)
+    count = partials.totals()['hist']
+    if not count.sum():
+        print('Skipping packet size CDF, the results have no txPk:vector(packetBytes) values.')
+        return
+    pdf = count / sum(count)
+    cdf = np.cumsum(pdf)
+
+    plt.plot(partials.bin_edges[1:], cdf, label='Packet Size CDF')
+    plt.title('Packet Size CDF')
+    plt.xlabel('Packet Size (in bytes)')
+    plt.ylabel('CDF')
+    figure_output.savefig('packet_size_cdf.png')
+    plt.clf()
+
+
+def traffic_matrix_graphics(vec_connection, cells, racks, windows=10,
+                            memory_budget=vector_aggregation.DEFAULT_MEMORY_BUDGET, top=5, matrix=None):
+    """
+    traffic_matrix_graphics creates one rack to rack heatmap per time window from
+    the packets actually received, along with a table of the busiest rack pairs
+    in every window.
+
+    Unlike the heatmap built from the configured sendBytes, this reflects
+    observed traffic and is built in a single pass over vectorData. matrix can be
+    passed in when the (matrix, time_edges) of traffic_matrix.build_traffic_matrix
+    are already at hand.
+    """
+    if not cells or not racks:
+        print('Skipping traffic matrix, the results do not set the rows, columns and racks of the network.')
+        return
+    if matrix is None:
+        matrix = traffic_matrix.build_traffic_matrix(vec_connection, cells * racks, racks, windows,
+                                                     memory_budget=memory_budget)
+    matrix, time_edges = matrix
+    windows = len(time_edges) - 1
+    axis_labels = [rack for cell in range(cells) for rack in range(racks)]
+
+    # One heatmap per time window, sharing a colour scale so slices can be compared.
+    #   The seaborn style is only applied to these figures, not set globally.
+    vmax = matrix.max() or 1
+    with sns.axes_style('darkgrid'), sns.plotting_context('notebook', font_scale=0.5):
+        for window in range(windows):
+            fig, ax = plt.subplots()
+            lod_heatmap.render(matrix[window], ax, axis_labels, vmin=0, vmax=vmax)
+            ax.set_xlabel('Rack From', fontsize=18)
+            ax.yaxis.set_label_text('Rack To', fontsize=18)
+            ax.set_title('Received Bytes %.3f - %.3f sec' % (time_edges[window], time_edges[window + 1]), fontsize=18)
+            figure_output.savefig('traffic_between_racks_window_%d.png' % window)
+            plt.close(fig)
+
+    # Hot-spot summary, top rack pairs per window.
+    fig, ax = plt.subplots(1, 1)
+    data = [['%.3f - %.3f' % (start, end), '%d.%d' % divmod(frm, racks), '%d.%d' % divmod(to, racks), int(size)]
+            for start, end, frm, to, size in traffic_matrix.hot_spots(matrix, time_edges, top)]
+    column_labels = ['Window (sec)', 'Cell.Rack From', 'Cell.Rack To', 'Bytes Received']
+    ax.axis('off')
+    if data:
+        table = ax.table(cellText=data, colLabels=column_labels, loc='center')
+        table.scale(3, 3)
+        table.set_fontsize(24)
+    figure_output.savefig('traffic_hot_spots_table.png', bbox_inches='tight')
+    plt.clf()
+
+
+def distribution_graphics(vec_connection, flows=None):
+    """
+    distribution_graphics creates the intra/extra cell and rack pie charts and
+    the flow size, length and rate CDFs.
+
+    flows can be passed in when the results of collect_flows are already at hand,
+    otherwise they are collected from vec_connection.
+    """
+    if flows is None:
+        flows = collect_flows(vec_connection)
+    sizes_list = flows['sizes_list']
+    lengths_list = flows['lengths_list']
+    rates_list = flows['rates_list']
 
     # Intra-Cell vs Extra-Cell
     fig, ax = plt.subplots()
-    ax.pie([intra_cell, extra_cell], labels=['Intra-Cellular', 'Extra-Cellular'], autopct='%1.1f%%')
+    ax.pie([flows['intra_cell'], flows['extra_cell']], labels=['Intra-Cellular', 'Extra-Cellular'], autopct='%1.1f%%')
     ax.set_title('Traffic Distribution')
-    plt.savefig('intravsextra_cell.png')
+    figure_output.savefig('intravsextra_cell.png')
     plt.clf()
 
     # Intra-Rack vs Extra-Rack
     fig, ax = plt.subplots()
-    ax.pie([intra_rack, extra_rack], labels=['Intra-Rack', 'Extra-Rack'], autopct='%1.1f%%')
+    ax.pie([flows['intra_rack'], flows['extra_rack']], labels=['Intra-Rack', 'Extra-Rack'], autopct='%1.1f%%')
     ax.set_title('Traffic Distribution')
-    plt.savefig('intravsextra_rack.png')
+    figure_output.savefig('intravsextra_rack.png')
     plt.clf()
 
     # Flow Size CDF
@@ -143,7 +292,7 @@ def main():
     plt.title('Flow Size CDF')
     plt.xlabel('Flow Size (in MiB)')
     plt.ylabel('CDF')
-    plt.savefig('flow_size_cdf.png')
+    figure_output.savefig('flow_size_cdf.png')
     plt.clf()
 
     # Flow Length CDF
@@ -155,7 +304,7 @@ def main():
     plt.title('Flow Length CDF')
     plt.xlabel('Flow Length (in sec)')
     plt.ylabel('CDF')
-    plt.savefig('flow_length_cdf.png')
+    figure_output.savefig('flow_length_cdf.png')
     plt.clf()
 
     # Flow Rate CDF
@@ -167,205 +316,190 @@ def main():
     plt.title('Flow Rate CDF')
     plt.xlabel('Flow Rate (in MBps)')
     plt.ylabel('CDF')
-    plt.savefig('flow_rate_cdf.png')
+    figure_output.savefig('flow_rate_cdf.png')
     plt.clf()
 
+
+def heatmap_graphics(vec_connection, flows=None, heats=None):
+    """
+    heatmap_graphics creates the heatmaps of the configured traffic between racks
+    and between cells.
+
+    The rack matrix is pre-aggregated per cell and drawn as a raster image,
+    so large topologies render quickly at either level. heats can be passed in
+    when the levels from traffic_levels are already at hand.
+    """
+    if flows is None:
+        flows = collect_flows(vec_connection)
+    info = run_info.run_info(vec_connection)
+    num_cells = (info.rows or 0) * (info.columns or 0)
+    num_racks = info.racks or 0
+    if not num_cells or not num_racks:
+        print('Skipping traffic heatmaps, the results do not set the rows, columns and racks of the network.')
+        return
+    if heats is None:
+        heats = traffic_levels(flows['heat_dict'], num_cells, num_racks)
+    axis_labels = [rack for cell in range(num_cells) for rack in range(num_racks)]
+
     # Full Traffic Size Heatmap
-    # TODO: Currently num cells and num racks is hardcoded. Not ideal.
-    num_cells = 9
-    num_racks = 8
-    heats = []
-    for i in range(num_cells):
-        for j in range(num_racks):
-            rack_heats = []
-            for k in range(num_cells):
-                for l in range(num_racks):
-                    if (i, j, k, l) in heat_dict:
-                        rack_heats.append(heat_dict[(i, j, k, l)][0])
-                    else:
-                        rack_heats.append(0)
-            heats.append(rack_heats)
-
-    # TODO: Currently axis labels are also hardcoded.
-    axis_labels = [0, 1, 2, 3, 4, 5, 6, 7, 0, 1, 2, 3, 4, 5, 6, 7, 0, 1, 2, 3, 4, 5, 6, 7,
-                   0, 1, 2, 3, 4, 5, 6, 7, 0, 1, 2, 3, 4, 5, 6, 7, 0, 1, 2, 3, 4, 5, 6, 7,
-                   0, 1, 2, 3, 4, 5, 6, 7, 0, 1, 2, 3, 4, 5, 6, 7, 0, 1, 2, 3, 4, 5, 6, 7]
-
-    sns.set(font_scale=0.5)
-    heats = list(map(list, zip(*heats)))
-    ax = sns.heatmap(heats, xticklabels=axis_labels, yticklabels=axis_labels, cmap='hot_r')
-    ax.set_xlabel('Rack From', fontsize=18)
-    ax.yaxis.set_label_text('Rack To', fontsize=18)
-    ax.invert_yaxis()
-
-    plt.savefig('traffic_between_racks.png')
-
-    # Add lines to separate cells for easier visual parsing.
-    ax.hlines(list(np.arange(0, 80, 8)), *ax.get_xlim(), linewidth=0.5)
-    ax.vlines(list(np.arange(0, 80, 8)), *ax.get_ylim(), linewidth=0.5)
-
-    plt.savefig('traffic_between_racks_lines.png')
+    #   The seaborn style is only applied to these figures, not set globally.
+    with sns.axes_style('darkgrid'), sns.plotting_context('notebook', font_scale=0.5):
+        fig, ax = plt.subplots()
+        lod_heatmap.render(heats['rack'], ax, axis_labels)
+        ax.set_xlabel('Rack From', fontsize=18)
+        ax.yaxis.set_label_text('Rack To', fontsize=18)
 
-    plt.clf()
+        figure_output.savefig('traffic_between_racks.png')
 
-    # Create cursor for querying runAttr table,
-    #   this contains the network information we will use.
-    # --------------------------------------
-    # | runId   | attrName  | attrValue    |
-    # --------------------------------------
-    cur = con.execute('SELECT * FROM runAttr')
-
-    info_configname = ''
-    info_datetime = ''
-    info_network = ''
-    info_cells = info_rows * info_cols
-    for row in cur:
-        if 'configname' in row[1]:
-            info_configname = row[2]
-        elif 'datetime' in row[1]:
-            info_datetime = row[2]
-        elif 'network' in row[1]:
-            info_network = row[2]
+        # Add lines to separate cells for easier visual parsing.
+        lod_heatmap.separate_blocks(ax, num_cells * num_racks, num_racks)
+
+        figure_output.savefig('traffic_between_racks_lines.png')
+
+        plt.clf()
+
+        # Cell level of the same heatmap.
+        fig, ax = plt.subplots()
+        lod_heatmap.render(heats['cell'], ax, list(range(num_cells)))
+        ax.set_xlabel('Cell From', fontsize=18)
+        ax.yaxis.set_label_text('Cell To', fontsize=18)
+        figure_output.savefig('traffic_between_cells.png')
+        plt.clf()
+
+
+def info_tables(vec_connection, flows=None):
+    """
+    info_tables creates the tables with generic information about the network
+    and about the traffic in the simulation.
+    """
+    if flows is None:
+        flows = collect_flows(vec_connection)
+    info = run_info.run_info(vec_connection)
+    info_racks = info.racks or 0
+    info_hosts = info.hosts or 0
+    info_cells = (info.rows or 0) * (info.columns or 0)
 
     # Generate a table/chart with some generic info about
     #   the simulation.
     fig, ax = plt.subplots(1, 1)
-    data = [[info_configname, info_datetime, info_network, info_cells, info_racks, info_cells*info_racks, info_hosts, info_hosts*(info_cells*info_racks)]]
+    data = [[info.configname or '', info.datetime or '', info.network or '', info_cells, info_racks,
+             info_cells*info_racks, info_hosts, info_hosts*(info_cells*info_racks)]]
     column_labels = ['Config Name', 'Date-time', 'Network', 'Cells', 'Racks Per Cell', 'Total Racks', 'Hosts Per Rack', 'Total Hosts']
     #ax.axis('tight')
     ax.axis('off')
     table = ax.table(cellText=data, colLabels=column_labels, loc='center')
     table.scale(3, 3)
     table.set_fontsize(24)
-    plt.savefig('network_info_table.png',bbox_inches='tight')
+    figure_output.savefig('network_info_table.png',bbox_inches='tight')
     plt.clf()
 
     # Generate a table/chart with some generic info about
     #   traffic in the simulation.
     fig, ax = plt.subplots(1, 1)
-    total_traffic = sum(sizes_list)
-    data = [[total_traffic, intra_cell/total_traffic*100, extra_cell/total_traffic*100, intra_rack/total_traffic*100, extra_rack/total_traffic*100]]
+    total_traffic = sum(flows['sizes_list'])
+    data = [[total_traffic, flows['intra_cell']/total_traffic*100, flows['extra_cell']/total_traffic*100,
+             flows['intra_rack']/total_traffic*100, flows['extra_rack']/total_traffic*100]]
     column_labels = ['Total Traffic (in MiB)', 'Intra-Cell %', 'Extra-Cell %', 'Intra-Rack %', 'Extra-Rack %']
     ax.axis('tight')
     ax.axis('off')
     table = ax.table(cellText=data, colLabels=column_labels, loc='center')
     table.scale(3, 3)
     table.set_fontsize(24)
-    plt.savefig('network_traffic_info_table.png',bbox_inches='tight')
+    figure_output.savefig('network_traffic_info_table.png',bbox_inches='tight')
     plt.clf()
 
-    # TODO: Packet Size CDF having some issues due to the size of the vector table.
-    # Packet Size CDF
-    # cur = con.execute('SELECT * FROM vector')
-    # packet_transfer_ids = []
-    # for row in cur:
-    #     if 'txPk:vector(packetBytes)' in row[3]:
-    #         packet_transfer_ids.append(row[0])
-    #
-    # cur = con.execute('SELECT * FROM vectorData')
-    # packet_sizes = []
-    # for id in packet_transfer_ids:
-    #     query = 'SELECT * FROM vectorData WHERE vectorId=' + str(id)
-    #     cur = con.execute(query)
-    #     for row in cur:
-    #         packet_sizes.append(row[3])
-    #
-    # count, bins_count = np.histogram(packet_sizes, bins=10)
-    # pdf = count / sum(count)
-    # cdf = np.cumsum(pdf)
-    #
-    # plt.plot(bins_count[1:], cdf, label='Packet Size CDF')
-    # plt.title('Packet Size CDF')
-    # plt.xlabel('Packet Size (in bytes)')
-    # plt.ylabel('CDF')
-    # plt.savefig('packet_size_cdf.png')
-    # plt.clf()
-
-    # Open a connection to sca database.
-    con = create_connection(sca_database)
 
-    # TODO: UPDATE THIS TO USE SQL QUERY INSTEAD OF ITERATING
-    # Create cursor for querying scalar table,
-    #   this contains the utilization and packet
-    #   drop information we will use.
-    # -----------------------------------------------------------------------
-    # | scalarId   | runID  | moduleName    | scalarName    | scalarValue   |
-    # -----------------------------------------------------------------------
-    cur = con.execute('SELECT * FROM scalar')
-
-    # Initialize variables to hold the utilization and packet drop information.
-    utilizations = []
-    transfer_count = 0
-    receive_count = 0
-    pd_bad_checksum = 0
-    pd_wrong_port = 0
-    pd_address_resolution_failed = 0
-    pd_forwarding_disabled = 0
-    pd_hop_limit_reached = 0
-    pd_incorrectly_received = 0
-    pd_interface_down = 0
-    pd_no_interface_found = 0
-    pd_no_route_found = 0
-    pd_not_addressed_to_us = 0
-    pd_queue_overflow = 0
-    pd_undefined = 0
-    for row in cur:
-        if 'rx channel utilization' in row[3]:
-            utilizations.append(row[4])
-        elif 'txPk:count' in row[3]:
-            transfer_count += row[4]
-        elif 'rxPkOk:count' in row[3]:
-            receive_count += row[4]
-        elif 'droppedPkBadChecksum:count' in row[3]:
-            pd_bad_checksum += row[4]
-        elif 'droppedPkWrongPort:count' in row[3]:
-            pd_wrong_port += row[4]
-        elif 'packetDropAddressResolutionFailed:count' in row[3]:
-            pd_address_resolution_failed += row[4]
-        elif 'packetDropForwardingDisabled:count' in row[3]:
-            pd_forwarding_disabled += row[4]
-        elif 'packetDropHopLimitReached:count' in row[3]:
-            pd_hop_limit_reached += row[4]
-        elif 'packetDropIncorrectlyReceived:count' in row[3]:
-            pd_incorrectly_received += row[4]
-        elif 'packetDropInterfaceDown:count' in row[3]:
-            pd_interface_down += row[4]
-        elif 'packetDropNoInterfaceFound:count' in row[3]:
-            pd_no_interface_found += row[4]
-        elif 'packetDropNoRouteFound:count' in row[3]:
-            pd_no_route_found += row[4]
-        elif 'packetDropNotAddressedToUs:count' in row[3]:
-            pd_not_addressed_to_us += row[4]
-        elif 'packetDropQueueOverflow:count' in row[3]:
-            pd_queue_overflow += row[4]
-        elif 'packetDropUndefined:count' in row[3]:
-            pd_undefined += row[4]
+def utilization_and_drop_graphics(sca_connection, scalars=None):
+    """
+    utilization_and_drop_graphics creates the tables of the average utilization,
+    the packets transferred and received and the packets dropped for each reason.
+
+    scalars can be passed in when the results of collect_scalars are already at hand.
+    """
+    if scalars is None:
+        scalars = collect_scalars(sca_connection)
 
     # Generate a table/chart with some info about
     #   utilization and loss in the simulation.
     fig, ax = plt.subplots()
-    avg_utilization = statistics.fmean(utilizations)
-    data = [[avg_utilization, int(transfer_count), int(receive_count)]]
+    avg_utilization = statistics.fmean(scalars['utilizations'])
+    data = [[avg_utilization, int(scalars['transfer_count']), int(scalars['receive_count'])]]
     column_labels = ['Average Channel Utilization (%)', 'Packets Transferred', 'Packets Received']
     ax.axis('tight')
     ax.axis('off')
     table = ax.table(cellText=data, colLabels=column_labels, loc='center')
     table.scale(3, 3)
     table.set_fontsize(24)
-    plt.savefig('utilization_table.png', bbox_inches='tight')
+    figure_output.savefig('utilization_table.png', bbox_inches='tight')
 
-    data2 = [[pd_bad_checksum, pd_wrong_port, pd_address_resolution_failed, pd_forwarding_disabled,
-              pd_hop_limit_reached, pd_incorrectly_received, pd_interface_down, pd_no_route_found,
-              pd_not_addressed_to_us, pd_queue_overflow, pd_undefined]]
+    data2 = [[scalars[key] for key in ['pd_bad_checksum', 'pd_wrong_port', 'pd_address_resolution_failed',
+                                       'pd_forwarding_disabled', 'pd_hop_limit_reached', 'pd_incorrectly_received',
+                                       'pd_interface_down', 'pd_no_route_found', 'pd_not_addressed_to_us',
+                                       'pd_queue_overflow', 'pd_undefined']]]
     column_labels2 = ['Bad Checksum', 'Wrong Port', 'Address Resolution Failed', 'Forwarding Disabled',
                       'Hop Limit Reached', 'Incorrectly Received', 'Interface Down', 'No Route Found',
                       'Not Addressed to Us', 'Queue Overflow', 'Undefined']
     table2 = ax.table(cellText=data2, colLabels=column_labels2, loc='center')
     table2.scale(3,3)
     table2.set_fontsize(24)
-    plt.savefig('packet_drop_table.png', bbox_inches='tight')
+    figure_output.savefig('packet_drop_table.png', bbox_inches='tight')
     plt.clf()
 
 
+def main():
+    parser = argparse.ArgumentParser(description='Generate graphics for an optical wireless cell network simulation.')
+    parser.add_argument('--vec', default='/share/test-#3-large.owcell.vec', help='vector results file')
+    parser.add_argument('--sca', default='/share/test-#3-large.owcell.sca', help='scalar results file')
+    parser.add_argument('--preview', type=vector_aggregation.preview_fraction, nargs='?', const=0.01,
+                        metavar='FRACTION',
+                        help='estimate vector metrics from a sample of vectorData (default 0.01)')
+    figure_output.add_arguments(parser)
+    args = parser.parse_args()
+    figure_output.configure_from_args(args)
+
+    # Path for database to be opened.
+    vec_database = args.vec
+    sca_database = args.sca
+
+    # Memory budget in bytes for reading vectorData and number of
+    #   processes to scan it with (None uses every core).
+    memory_budget = vector_aggregation.DEFAULT_MEMORY_BUDGET
+    processes = None
+
+    # Number of time windows for the time-sliced traffic heatmaps.
+    windows = 10
+
+    # Create connection to database.
+    con = create_connection(vec_database)
+
+    # Collect the flows from runParam once for every section using them.
+    flows = collect_flows(con)
+
+    # ----- Create and save plots -----
+    # ---------------------------------
+    distribution_graphics(con, flows)
+    heatmap_graphics(con, flows)
+
+    # Traffic heatmaps per time window from the received packets.
+    #   These need every packet, so they are left out of a preview.
+    if not args.preview:
+        info = run_info.run_info(con)
+        traffic_matrix_graphics(con, (info.rows or 0) * (info.columns or 0), info.racks or 0, windows, memory_budget)
+
+    info_tables(con, flows)
+
+    # Packet Size CDF
+    # vectorData is aggregated out-of-core so this works on files larger than RAM.
+    packet_size_cdf(con, memory_budget, processes=processes, preview=args.preview)
+
+    # Open a connection to sca database and
+    #   create the utilization and packet drop tables.
+    con = create_connection(sca_database)
+    utilization_and_drop_graphics(con)
+
+    # Wait for the figures still being written.
+    figure_output.flush()
+
+
 if __name__ == '__main__':
     main()
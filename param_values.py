@@ -0,0 +1,214 @@
+"""
+param_values.py
+
+This file parses OMNeT++ parameter values into canonical SI values.
+
+Whole columns of paramValue strings are converted at once with vectorized
+regular expressions and unit tables: quantities such as 10MiB, 1.5ms or
+compound values like 1s 500ms become bytes or seconds. Every distinct
+literal is parsed only once and kept in a cache, and entries that cannot be
+parsed (e.g. random distributions) become NaN with a warning.
+
+flow_table uses this to extract the traffic applications configured in the
+runParam table in a single query.
+"""
+import re
+import warnings
+import numpy as np
+import pandas as pd
+
+
+# Multipliers to the canonical unit of each kind of quantity, bytes and seconds.
+UNITS = {
+    'bytes': {'': 1, 'B': 1, 'KiB': 2 ** 10, 'MiB': 2 ** 20, 'GiB': 2 ** 30, 'TiB': 2 ** 40,
+              'kB': 10 ** 3, 'KB': 10 ** 3, 'MB': 10 ** 6, 'GB': 10 ** 9, 'TB': 10 ** 12,
+              'b': 1 / 8, 'Kib': 2 ** 10 / 8, 'Mib': 2 ** 20 / 8, 'Gib': 2 ** 30 / 8,
+              'kb': 10 ** 3 / 8, 'Mb': 10 ** 6 / 8, 'Gb': 10 ** 9 / 8},
+    'seconds': {'': 1, 's': 1, 'ms': 1e-3, 'us': 1e-6, 'ns': 1e-9, 'ps': 1e-12, 'fs': 1e-15,
+                'min': 60, 'h': 3600, 'd': 86400},
+    'number': {'': 1},
+}
+
+# A single number with an optional unit, e.g. 1.5e3ms.
+QUANTITY = r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([A-Za-z]*)'
+
+# A whole value made of one or more quantities, e.g. 1s 500ms or 1s + 500ms.
+VALUE_PATTERN = re.compile(r'^\s*%s(?:\s*\+?\s*%s)*\s*$' % (QUANTITY, QUANTITY))
+
+# Parameters of a traffic application used to describe a flow.
+FLOW_PARAMS = ['sendBytes', 'tOpen', 'tSend', 'tClose', 'connectAddress']
+
+# Pieces of an OMNeT++ module pattern: **, *, ?, {a..b} / [a..b] numeric ranges and {a-z} character sets.
+PATTERN_TOKEN = re.compile(r'\*\*|\*|\?|\{(\d*)\.\.(\d*)\}|\[(\d*)\.\.(\d*)\]|\{([^}]*)\}')
+
+# Parsed literals, {(kind, literal): value}, emptied once it holds MAX_CACHED_LITERALS.
+_cache = {}
+
+# Bound on the parsed literal cache so long running processes do not grow without limit.
+MAX_CACHED_LITERALS = 100000
+
+
+def _parse_unique(literals, kind):
+    # Parse distinct literals not seen before and store them in the cache.
+    units = UNITS[kind]
+    values = pd.Series(literals, dtype=object).str.strip().str.strip('"')
+    valid = values.str.fullmatch(VALUE_PATTERN).fillna(False).astype(bool)
+
+    parsed = pd.Series(np.nan, index=values.index)
+    if valid.any():
+        tokens = values[valid].str.extractall(QUANTITY)
+        # A quantity without a unit comes back as NaN rather than ''.
+        multipliers = tokens[1].fillna('').map(units)
+        amounts = tokens[0].astype(np.float64) * multipliers
+        # A value with any unknown unit is unparseable as a whole.
+        known = multipliers.notna().groupby(level=0).all()
+        totals = amounts.groupby(level=0).sum()
+        parsed[totals.index] = totals.where(known)
+
+    for literal, value in zip(literals, parsed):
+        _cache[(kind, literal)] = value
+
+
+def parse_quantities(values, kind='number'):
+    """
+    parse_quantities is used to convert a column of paramValue strings into
+    floats in the canonical unit of kind ('bytes', 'seconds' or 'number').
+
+    Returns a numpy array with NaN for entries that could not be parsed, a
+    warning lists the distinct unparseable literals.
+    """
+    codes, literals = pd.factorize(pd.Series(values, dtype=object))
+    if len(_cache) + len(literals) > MAX_CACHED_LITERALS:
+        _cache.clear()
+    missing = [literal for literal in literals if (kind, literal) not in _cache]
+    if missing:
+        _parse_unique(missing, kind)
+
+    parsed = np.array([_cache[(kind, literal)] for literal in literals], dtype=np.float64)
+    unparseable = [literal for literal, value in zip(literals, parsed) if np.isnan(value)]
+    if unparseable:
+        warnings.warn('Could not parse %d %s value(s): %s' % (len(unparseable), kind,
+                                                              ', '.join(map(str, unparseable[:5]))))
+
+    result = np.full(len(codes), np.nan)
+    result[codes >= 0] = parsed[codes[codes >= 0]]
+
+    return result
+
+
+def module_matcher(pattern):
+    """
+    module_matcher returns a function telling whether a module path matches the
+    module part of an ini key such as **.host[*].app[0..3], with OMNeT++ semantics:
+    ** matches anything, * and ? do not cross a dot, {a..b} and [a..b] match numbers
+    in a range and {a-z} matches a character set. Brackets are otherwise literal.
+    """
+    parts, ranges, position = [], [], 0
+    for token in PATTERN_TOKEN.finditer(pattern):
+        parts.append(re.escape(pattern[position:token.start()]))
+        text = token.group(0)
+        if text == '**':
+            parts.append('.*')
+        elif text == '*':
+            parts.append('[^.]*')
+        elif text == '?':
+            parts.append('[^.]')
+        elif token.group(5) is not None:
+            parts.append('[%s]' % token.group(5).replace('\\', '\\\\').replace(']', '\\]'))
+        else:
+            low, high = token.group(1, 2) if text.startswith('{') else token.group(3, 4)
+            ranges.append((int(low) if low else None, int(high) if high else None))
+            parts.append(r'\[(\d+)\]' if text.startswith('[') else r'(\d+)')
+        position = token.end()
+    parts.append(re.escape(pattern[position:]))
+    regex = re.compile(''.join(parts))
+
+    def matches(module):
+        match = regex.fullmatch(module)
+        return match is not None and all((low is None or int(number) >= low) and (high is None or int(number) <= high)
+                                         for number, (low, high) in zip(match.groups(), ranges))
+
+    return matches
+
+
+def _resolve_patterns(flows, params):
+    # Fill parameters set through module patterns (e.g. **.app[*].tOpen) into flows,
+    # the first key in configuration order that matches a module wins, as in OMNeT++.
+    wildcards = r'[*?{]|\.\.\]'
+    patterns = params[params['module'].str.contains(wildcards) & (params['name'] != 'sendBytes')]
+    if patterns.empty:
+        return
+    # The common **.rest matches every flow ending in .rest, no regex needed.
+    simple = patterns['module'].str.startswith('**.') & ~patterns['module'].str[3:].str.contains(wildcards)
+    columns = [patterns[column].tolist() for column in ['module', 'name', 'paramValue', 'paramOrder']]
+    columns.append(simple.tolist())
+    tails = [module[2:] if is_simple else module[list(PATTERN_TOKEN.finditer(module))[-1].end():]
+             for module, is_simple in zip(columns[0], columns[4])]
+
+    # Flows by the literal tails they end in, so a pattern such as **.host[0].app[0]
+    # is only tried on the flows it can match.
+    modules = flows.index.tolist()
+    wanted = set(tail for tail in tails if tail.startswith('.'))
+    lengths = set(len(tail) for tail in wanted)
+    suffixes = {}
+    for flow in modules:
+        for length in lengths:
+            if flow[-length:] in wanted:
+                suffixes.setdefault(flow[-length:], []).append(flow)
+
+    # Position of the key each flow parameter was last set from, {(module, name): position}.
+    order = dict(zip(zip(params['module'].tolist(), params['name'].tolist()), params['paramOrder'].tolist()))
+    resolved = {}
+    for module, name, value, position, is_simple, tail in zip(*columns, tails):
+        candidates = suffixes.get(tail, []) if tail.startswith('.') else modules
+        matches = None if is_simple else module_matcher(module)
+        for flow in candidates:
+            if position <= order.get((flow, name), position) and (matches is None or matches(flow)):
+                resolved.setdefault(name, {})[flow] = value
+                order[(flow, name)] = position
+
+    for name, values in resolved.items():
+        flows.loc[list(values), name] = list(values.values())
+
+
+def flow_table(connection):
+    """
+    flow_table returns a DataFrame with one row per traffic application that has
+    a sendBytes parameter, indexed by module path in configuration order.
+
+    sendBytes is in bytes, tOpen, tSend and tClose are in seconds (0 when not set)
+    and connectAddress is kept as written. Parameters set for a module pattern such
+    as **.app[*].tOpen apply to every application they match, see module_matcher. Applications with a sendBytes or time
+    that cannot be parsed (e.g. a random distribution) are left out with a warning.
+    """
+    # -------------------------------------------------------
+    # | runId   | paramKey  | paramValue    | paramOrder    |
+    # -------------------------------------------------------
+    params = pd.DataFrame(connection.execute('SELECT paramKey, paramValue FROM runParam').fetchall(),
+                          columns=['paramKey', 'paramValue'])
+    params['paramOrder'] = np.arange(len(params))
+    split = params['paramKey'].str.rpartition('.')
+    params['module'] = split[0]
+    params['name'] = split[2]
+    params = params[params['name'].isin(FLOW_PARAMS)].drop_duplicates(['module', 'name'])
+
+    flows = params.pivot(index='module', columns='name', values='paramValue')
+    flows = flows.reindex(index=pd.unique(params['module']), columns=FLOW_PARAMS)
+    flows = flows[flows['sendBytes'].notna()].copy()
+    _resolve_patterns(flows, params)
+
+    untimed = flows[['tOpen', 'tSend', 'tClose']].isna().all(axis=1)
+    if untimed.any():
+        warnings.warn('No tOpen, tSend or tClose matches %d of %d flows, their times are 0: %s'
+                      % (untimed.sum(), len(flows), ', '.join(flows.index[untimed][:5])))
+
+    flows['sendBytes'] = parse_quantities(flows['sendBytes'], 'bytes')
+    for name in ['tOpen', 'tSend', 'tClose']:
+        flows[name] = parse_quantities(flows[name].fillna('0s'), 'seconds')
+
+    unparsed = flows[['sendBytes', 'tOpen', 'tSend', 'tClose']].isna().any(axis=1)
+    if unparsed.any():
+        warnings.warn('Leaving out %d of %d flows with unparseable parameters: %s'
+                      % (unparsed.sum(), len(flows), ', '.join(flows.index[unparsed][:5])))
+
+    return flows[~unparsed]
@@ -0,0 +1,432 @@
+"""
+report_server.py
+
+This file runs a long-lived local report server so the cost of Python
+startup, plotting imports, opening the SQLite results file and scanning its
+tables is paid once instead of on every report.
+
+Parsed flow tables, scalar aggregates and vectorData aggregates are kept in
+memory per result, with least recently used results evicted once the cache is
+full. A result is reloaded automatically when one of its files changes on disk.
+
+A result is a vector file and, as OMNeT++ writes them separately, an optional
+scalar file. Every section reads the file holding its tables, and a request is
+rejected before any figure is written when a table it needs is missing.
+
+Usage:
+python report_server.py [--port 8765 | --socket /tmp/network_reports.sock] [--cache-size 4] [--output DIR]
+
+Requests (GET, figures and sections are written to the --output directory,
+sca defaults to file when a single file holds every table):
+/report?file=<vec>&sca=<sca>&kind=spineleaf                 every section of the report
+/section?file=<vec>&sca=<sca>&kind=spineleaf&name=traffic   a single section, see SECTIONS
+/section?file=<vec>&sca=<sca>&kind=owcell&name=distribution
+/figure?file=<vec>&sca=<sca>&kind=owcell&metric=flow_size&bins=50&xscale=log&format=png
+/heatmap?file=<vec>&sca=<sca>&kind=owcell&level=cell&from=3&to=4&format=png   drill into a block
+/heatmap?file=<vec>&sca=<sca>&kind=owcell&level=rack&from=3&to=17              hosts of two racks
+/evict?file=<results>
+/status
+"""
+import argparse
+import io
+import json
+import os
+import socketserver
+import time
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import spineleaf_network_report as spineleaf
+import owcell_network_report as owcell
+import lod_heatmap
+import columnar_export
+import traffic_matrix
+import run_info
+import figure_output
+
+
+# Report script behind each kind of result.
+REPORTS = {'spineleaf': spineleaf, 'owcell': owcell}
+
+# Functions collecting the data cached for a result, called with the CachedResult.
+COLLECTORS = {
+    'spineleaf': {
+        'traffic': lambda result: spineleaf.collect_traffic(result.sca),
+        'utilization': lambda result: spineleaf.collect_utilization(result.sca),
+        'throughput': lambda result: spineleaf.aggregate_throughput_and_delay(result.vec),
+        'heatmap': lambda result: _spineleaf_heats(result),
+    },
+    'owcell': {
+        'flows': lambda result: owcell.collect_flows(result.vec),
+        'scalars': lambda result: owcell.collect_scalars(result.sca),
+        'packet_sizes': lambda result: owcell.aggregate_packet_sizes(result.vec),
+        'traffic_matrix': lambda result: _owcell_traffic_matrix(result),
+        'heatmap': lambda result: _owcell_heats(result),
+    },
+}
+
+# Report sections that can be regenerated from a cached result.
+SECTIONS = {
+    'spineleaf': {
+        'attributes': lambda result: spineleaf.attribute_table(result.sca),
+        'traffic': lambda result: spineleaf.traffic_graphics(result.sca, result.get('traffic'),
+                                                             result.get('heatmap')[0]),
+        'utilization': lambda result: spineleaf.utilization_and_drop_graphics(result.sca, result.get('utilization')),
+        'throughput': lambda result: spineleaf.throughput_and_delay_graphics(result.vec,
+                                                                             aggregates=result.get('throughput')),
+    },
+    'owcell': {
+        'distribution': lambda result: owcell.distribution_graphics(result.vec, result.get('flows')),
+        'heatmaps': lambda result: _owcell_heatmap_graphics(result),
+        'info': lambda result: owcell.info_tables(result.vec, result.get('flows')),
+        'utilization': lambda result: owcell.utilization_and_drop_graphics(result.sca, result.get('scalars')),
+        'packet_size': lambda result: owcell.packet_size_cdf(result.vec, partials=result.get('packet_sizes')),
+        'traffic_matrix': lambda result: _owcell_traffic_matrix_graphics(result),
+    },
+}
+
+# Tables read by every section and collector, from the vector ('vec') or scalar ('sca') file.
+VECTOR_TABLES = ['run', 'runParam', 'vector', 'vectorData']
+TABLES = {
+    'spineleaf': {
+        'attributes': {'sca': ['runAttr', 'runParam']},
+        'traffic': {'sca': ['runParam']},
+        'utilization': {'sca': ['scalar']},
+        'throughput': {'vec': VECTOR_TABLES},
+        'heatmap': {'sca': ['runParam']},
+    },
+    'owcell': {
+        'flows': {'vec': ['runParam']},
+        'scalars': {'sca': ['scalar']},
+        'distribution': {'vec': ['runParam']},
+        'heatmaps': {'vec': ['runParam']},
+        'heatmap': {'vec': ['runParam']},
+        'info': {'vec': ['runAttr', 'runParam']},
+        'utilization': {'sca': ['scalar']},
+        'packet_size': {'vec': VECTOR_TABLES},
+        'traffic_matrix': {'vec': VECTOR_TABLES},
+    },
+}
+
+# Values behind each CDF figure, as (data, key, scale, title, x label).
+METRICS = {
+    'spineleaf': {
+        'flow_size': ('traffic', 'sizes_list', 1048576, 'Flow Size CDF', 'Flow Size (in bytes)'),
+        'flow_length': ('traffic', 'lengths_list', 1000000, 'Flow Length CDF', 'Flow Length (in usecs)'),
+        'flow_rate': ('traffic', 'rates_list', 8, 'Flow Rate CDF', 'Flow Rate (in Mbps)'),
+        'utilization': ('utilization', 'utilizations', 1, 'Utilization CDF', 'Utilization'),
+        'spine_utilization': ('utilization', 'spine_utilizations', 1, 'Spine Utilization CDF', 'Spine Utilization'),
+        'leaf_utilization': ('utilization', 'leaf_utilizations', 1, 'Leaf Utilization CDF', 'Leaf Utilization'),
+    },
+    'owcell': {
+        'flow_size': ('flows', 'sizes_list', 1, 'Flow Size CDF', 'Flow Size (in MiB)'),
+        'flow_length': ('flows', 'lengths_list', 1, 'Flow Length CDF', 'Flow Length (in sec)'),
+        'flow_rate': ('flows', 'rates_list', 1, 'Flow Rate CDF', 'Flow Rate (in MBps)'),
+        'utilization': ('scalars', 'utilizations', 1, 'Utilization CDF', 'Utilization'),
+    },
+}
+
+
+def _owcell_dimensions(result):
+    # Number of cells and racks per cell of an owcell result.
+    info = run_info.run_info(result.vec)
+    return (info.rows or 0) * (info.columns or 0), info.racks or 0
+
+
+def _levels(heats):
+    # (name, block) list of pre-aggregated levels, block in rows of the finest level.
+    finest = list(heats.values())[-1].shape[0]
+    return [(name, finest // max(matrix.shape[0], 1)) for name, matrix in heats.items()]
+
+
+def _owcell_heats(result):
+    cells, racks = _owcell_dimensions(result)
+    if not cells or not racks:
+        raise ValueError('The results do not set the rows, columns and racks of the network')
+    flows = result.get('flows')
+    heats = owcell.traffic_levels(flows['heat_dict'], cells, racks, run_info.run_info(result.vec).hosts,
+                                  flows['host_heat_dict'])
+    return heats, _levels(heats)
+
+
+def _owcell_heatmap_graphics(result):
+    cells, racks = _owcell_dimensions(result)
+    heats = result.get('heatmap')[0] if cells and racks else None
+    owcell.heatmap_graphics(result.vec, result.get('flows'), heats)
+
+
+def _owcell_traffic_matrix(result):
+    cells, racks = _owcell_dimensions(result)
+    return traffic_matrix.build_traffic_matrix(result.vec, cells * racks, racks)
+
+
+def _owcell_traffic_matrix_graphics(result):
+    cells, racks = _owcell_dimensions(result)
+    matrix = result.get('traffic_matrix') if cells and racks else None
+    owcell.traffic_matrix_graphics(result.vec, cells, racks, matrix=matrix)
+
+
+def _spineleaf_heats(result):
+    heats = spineleaf.traffic_levels(result.get('traffic')['heat_dict'], run_info.run_info(result.sca).hosts)
+    return heats, _levels(heats)
+
+
+# Largest heatmap drawn when no level is requested.
+MAX_HEATMAP_ROWS = 512
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+
+
+class CachedResult:
+    """
+    CachedResult holds open connections to the vector and scalar files of a result
+    and the data collected from them, each piece collected the first time it is
+    asked for. Both connections are the same when one file holds every table.
+    """
+
+    def __init__(self, path, kind, sca_path=None):
+        self.path = path
+        self.sca_path = sca_path or path
+        self.kind = kind
+        self.mtimes = self._mtimes()
+        self.vec = REPORTS[kind].create_connection(self.path)
+        self.sca = self.vec if self.sca_path == self.path else REPORTS[kind].create_connection(self.sca_path)
+        self.data = {}
+
+    def _mtimes(self):
+        return os.path.getmtime(self.path), os.path.getmtime(self.sca_path)
+
+    def changed(self):
+        return self.mtimes != self._mtimes()
+
+    def missing_tables(self, names):
+        """
+        missing_tables returns the 'file: table' entries TABLES lists for names that
+        are not in the result files.
+        """
+        missing = []
+        for which in ['vec', 'sca']:
+            needed = {table for name in names for table in TABLES[self.kind].get(name, {}).get(which, [])}
+            if needed:
+                found = columnar_export.table_names(getattr(self, which))
+                path = self.path if which == 'vec' else self.sca_path
+                missing += ['%s: %s' % (path, table) for table in sorted(needed - found)]
+        return missing
+
+    def get(self, name):
+        if name not in self.data:
+            self.data[name] = COLLECTORS[self.kind][name](self)
+        return self.data[name]
+
+    def close(self):
+        self.vec.close()
+        run_info.forget(self.path)
+        if self.sca is not self.vec:
+            self.sca.close()
+            run_info.forget(self.sca_path)
+
+
+class ResultCache:
+    """
+    ResultCache keeps up to size CachedResults keyed by result files and kind,
+    evicting the least recently used one when full.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.results = OrderedDict()
+
+    def get(self, path, kind, sca_path=None):
+        key = (os.path.abspath(path), os.path.abspath(sca_path or path), kind)
+        result = self.results.get(key)
+        if result is not None and result.changed():
+            self.results.pop(key).close()
+            result = None
+        if result is None:
+            result = CachedResult(key[0], kind, key[1])
+            self.results[key] = result
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)[1].close()
+        self.results.move_to_end(key)
+
+        return result
+
+    def evict(self, path):
+        path = os.path.abspath(path)
+        for key in [key for key in self.results if path in key[:2]]:
+            self.results.pop(key).close()
+
+    def status(self):
+        return [{'file': path, 'sca': sca_path, 'kind': kind, 'cached': sorted(result.data)}
+                for (path, sca_path, kind), result in self.results.items()]
+
+
+def cdf_figure(values, bins, xscale, title, xlabel, fmt):
+    """
+    cdf_figure renders a CDF of values in the style of the report scripts and
+    returns the encoded image.
+    """
+    count, bins_count = np.histogram(values, bins=bins)
+    pdf = count / sum(count)
+    cdf = np.cumsum(pdf)
+
+    fig, ax = plt.subplots()
+    ax.plot(bins_count[1:], cdf, label=title, marker='o', markersize=4)
+    ax.set_xscale(xscale)
+    fig.set_figwidth(9)
+    fig.set_figheight(4)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('CDF')
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt)
+    plt.close(fig)
+
+    return buffer.getvalue()
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """
+    ReportHandler answers report, section and figure requests from the shared cache.
+    """
+    cache = None
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        start = time.perf_counter()
+        try:
+            if url.path == '/status':
+                self._send_json({'results': self.cache.status()})
+            elif url.path == '/evict':
+                self.cache.evict(query['file'])
+                self._send_json({'evicted': query['file']})
+            elif url.path in ('/report', '/section', '/figure', '/heatmap'):
+                kind = query.get('kind', 'spineleaf')
+                if url.path == '/figure':
+                    names = [METRICS[kind][query['metric']][0]]
+                elif url.path == '/heatmap':
+                    names = ['heatmap']
+                else:
+                    names = list(SECTIONS[kind]) if url.path == '/report' else [query['name']]
+                    unknown = [name for name in names if name not in SECTIONS[kind]]
+                    if unknown:
+                        raise KeyError(unknown[0])
+                result = self.cache.get(query['file'], kind, query.get('sca'))
+                # Checked before anything is drawn, so a request never writes half a report.
+                missing = result.missing_tables(names)
+                if missing:
+                    self.send_error(400, 'Missing tables: %s' % ', '.join(missing))
+                    return
+                if url.path == '/figure':
+                    self._figure(result, query)
+                    return
+                if url.path == '/heatmap':
+                    self._heatmap(result, query)
+                    return
+                for name in names:
+                    SECTIONS[kind][name](result)
+                    plt.close('all')
+                # Answer once the section figures are on disk.
+                errors = figure_output.flush()
+                self._send_json({'sections': names, 'errors': [str(e) for e in errors],
+                                 'seconds': time.perf_counter() - start})
+            else:
+                self.send_error(404)
+        except KeyError as e:
+            self.send_error(400, 'Missing or unknown value: %s' % e)
+        except Exception:
+            # The details stay in the server log, the client only learns the request failed.
+            self.log_error('%s failed:\n%s', self.path, traceback.format_exc())
+            self.send_error(500, 'Internal error, see the server log')
+
+    def _figure(self, result, query):
+        data, key, scale, title, xlabel = METRICS[result.kind][query['metric']]
+        values = [value * scale for value in result.get(data)[key]]
+        fmt = query.get('format', 'png')
+        body = cdf_figure(values, int(query.get('bins', 50)), query.get('xscale', 'log'), title, xlabel, fmt)
+        self._send_image(body, fmt)
+
+    def _heatmap(self, result, query):
+        # Cached with the rest of the result so zooming never re-aggregates.
+        try:
+            heats, levels = result.get('heatmap')
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        if 'from' in query and 'to' in query:
+            matrix = lod_heatmap.drill(heats, levels, query['level'], int(query['from']), int(query['to']))
+            title = '%s %s -> %s' % (query['level'].capitalize(), query['from'], query['to'])
+        else:
+            level = query.get('level') or lod_heatmap.pick_level(heats, int(query.get('max_rows', MAX_HEATMAP_ROWS)))
+            matrix = heats[level]
+            title = 'Traffic Between %ss' % level.capitalize()
+
+        fig, ax = plt.subplots()
+        lod_heatmap.render(matrix, ax)
+        ax.set_title(title)
+        fmt = query.get('format', 'png')
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt)
+        plt.close(fig)
+        self._send_image(buffer.getvalue(), fmt)
+
+    def _send_image(self, body, fmt):
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES.get(fmt, 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve network reports from results kept in memory.')
+    parser.add_argument('--port', type=int, default=8765, help='localhost port to listen on')
+    parser.add_argument('--socket', help='listen on this Unix socket instead of a port')
+    parser.add_argument('--cache-size', type=int, default=4, help='number of result files kept in memory')
+    figure_output.add_arguments(parser)
+    args = parser.parse_args()
+    figure_output.configure_from_args(args)
+
+    ReportHandler.cache = ResultCache(args.cache_size)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, ReportHandler)
+    else:
+        server = HTTPServer(('127.0.0.1', args.port), ReportHandler)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+run_info.py
+
+This file loads the metadata of every run in an OMNeT++ results file,
+the runAttr attributes and the configuration parameters the reports need,
+into typed RunInfo objects.
+
+runAttr and runParam are each read in a single pass per file and the result
+is memoized per file, so every report section shares it instead of querying
+one key at a time. A memoized file is read again once it changes on disk,
+connections without a file behind them are not memoized.
+
+runAttr layout:
+--------------------------------------
+| runId   | attrName  | attrValue    |
+--------------------------------------
+"""
+import os
+from dataclasses import dataclass, field
+import numpy as np
+import param_values
+
+
+# Configuration parameters kept from runParam, matched on the last component of paramKey.
+CONFIG_PARAMS = ['rows', 'columns', 'racks', 'hosts', 'leafs', 'numApps']
+
+# Loaded runs per results file, {path: (mtime, {runId: RunInfo})}.
+_cache = {}
+
+
+@dataclass
+class RunInfo:
+    """
+    RunInfo holds the attributes and configuration parameters of one run.
+
+    Attributes and parameters missing from the results file are None.
+    """
+    run_id: int
+    attributes: dict = field(default_factory=dict)
+    params: dict = field(default_factory=dict)
+    total_apps: float = None
+
+    @property
+    def configname(self):
+        return self.attributes.get('configname')
+
+    @property
+    def datetime(self):
+        return self.attributes.get('datetime')
+
+    @property
+    def experiment(self):
+        return self.attributes.get('experiment')
+
+    @property
+    def network(self):
+        return self.attributes.get('network')
+
+    @property
+    def rows(self):
+        return self._int('rows')
+
+    @property
+    def columns(self):
+        return self._int('columns')
+
+    @property
+    def racks(self):
+        return self._int('racks')
+
+    @property
+    def hosts(self):
+        return self._int('hosts')
+
+    @property
+    def leafs(self):
+        return self._int('leafs')
+
+    def _int(self, name):
+        # Values that are not plain numbers (e.g. expressions) are None, with a warning.
+        value = self.params.get(name)
+        if value is None:
+            return None
+        number = param_values.parse_quantities([value])[0]
+        return None if np.isnan(number) else int(number)
+
+
+def _results_path(connection):
+    # File behind connection, None for e.g. in-memory databases.
+    path = getattr(connection, 'columnar_path', None)
+    if not path:
+        path = next((row[2] for row in connection.execute('PRAGMA database_list') if row[1] == 'main'), '')
+    if path and os.path.exists(path):
+        return os.path.abspath(path)
+
+    return None
+
+
+def forget(path):
+    """
+    forget drops the memoized runs of the results file at path.
+    """
+    _cache.pop(os.path.abspath(path), None)
+
+
+def load_runs(connection):
+    """
+    load_runs is used to read every run of a results file into RunInfo objects,
+    returning a dictionary keyed by runId.
+
+    runAttr and runParam are each scanned once, results are memoized per file
+    until it changes on disk or is forgotten.
+    """
+    path = _results_path(connection)
+    mtime = os.path.getmtime(path) if path else None
+    if path in _cache and _cache[path][0] == mtime:
+        return _cache[path][1]
+
+    runs = {}
+    for run_id, name, value in connection.execute('SELECT runId, attrName, attrValue FROM runAttr'):
+        runs.setdefault(run_id, RunInfo(run_id)).attributes[name] = value
+
+    num_apps = {}
+    for run_id, key_name, value in connection.execute('SELECT runId, paramKey, paramValue FROM runParam'):
+        name = key_name.rsplit('.', 1)[-1]
+        if name not in CONFIG_PARAMS:
+            continue
+        info = runs.setdefault(run_id, RunInfo(run_id))
+        if name == 'numApps':
+            num_apps.setdefault(run_id, []).append(value)
+        else:
+            # The first matching key wins, as with the per key queries.
+            info.params.setdefault(name, value)
+
+    # numApps values that cannot be parsed are left out of the total with a warning.
+    for run_id, values in num_apps.items():
+        runs[run_id].total_apps = float(np.nansum(param_values.parse_quantities(values)))
+
+    if path:
+        _cache[path] = (mtime, runs)
+
+    return runs
+
+
+def run_info(connection, run_id=None):
+    """
+    run_info returns the RunInfo of run_id, or of the first run when run_id is None.
+    A results file without any run metadata gives an empty RunInfo.
+    """
+    runs = load_runs(connection)
+    if run_id is None:
+        run_id = min(runs) if runs else None
+
+    return runs.get(run_id, RunInfo(run_id))
@@ -10,6 +10,7 @@ Useful Links:
 https://docs.omnetpp.org/tutorials/pandas/
 https://docs.omnetpp.org/tutorials/tictoc/part6/
 """
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
@@ -18,16 +19,25 @@ import pandas as pd
 import sqlite3
 from sqlite3 import Error
 import statistics
-import re
+import vector_aggregation
+import columnar_export
+import lod_heatmap
+import run_info
+import param_values
+import figure_output
 
 
 def create_connection(db):
     """
     create_connection is utilized to connect to the OMNet++ results
-    file stored as a SQLite file.
+    file stored as a SQLite file, or to a columnar
+    export of it created with columnar_export.py.
     """
     con = None
     try:
+        # Directories written by columnar_export are loaded from Parquet.
+        if columnar_export.is_columnar(db):
+            return columnar_export.load_columnar(db)
         con = sqlite3.connect(db)
     except Error as e:
         print(e)
@@ -78,39 +88,128 @@ def throughput_graph(vec_connection):
     print('Average Packet Size: ' + str(total_packet_size / total_packet_count_pr))
 
 
-def attribute_table(sca_connection):
+def aggregate_throughput_and_delay(vec_connection, processes=None,
+                                   memory_budget=vector_aggregation.DEFAULT_MEMORY_BUDGET, windows=100):
     """
-    attribute_table is used to create a table of attributes describing
-    basic information about the table.
+    aggregate_throughput_and_delay is used to scan vectorData once for the received
+    bytes per time window and the end-to-end delays of every host application.
+
+    The scan is partitioned by rowid range across processes worker processes, each
+    returning per-vector histograms and windowed sums that are merged here.
+    Returns a dictionary of the 'received' and 'delays' VectorPartials.
     """
-    # Query the database for the required information.
-    info_configname = sca_connection.execute("""\
-                                SELECT attrValue FROM runAttr
-                                WHERE  attrName='configname'""").fetchall()[0][0]
+    ids = vector_aggregation.vector_ids(vec_connection, 'packetReceived:vector(packetBytes)', '%]')
+    received = vector_aggregation.parallel_aggregate_vectors(vec_connection, ids, processes, memory_budget,
+                                                             bins=50, time_bins=windows)
+    ids = vector_aggregation.vector_ids(vec_connection, 'endToEndDelay:vector', '%]')
+    delays = vector_aggregation.parallel_aggregate_vectors(vec_connection, ids, processes, memory_budget,
+                                                           bins=100, time_bins=1)
+
+    return {'received': received, 'delays': delays}
+
 
-    info_datetime = sca_connection.execute("""\
-                                SELECT attrValue FROM runAttr
-                                WHERE  attrName='datetime'""").fetchall()[0][0]
+def throughput_and_delay_graphics(vec_connection, processes=None,
+                                  memory_budget=vector_aggregation.DEFAULT_MEMORY_BUDGET, windows=100,
+                                  preview=None, aggregates=None):
+    """
+    throughput_and_delay_graphics is used to visualize throughput over time and
+    end-to-end packet delay using every row of vectorData.
+
+    aggregates can be passed in when the results of aggregate_throughput_and_delay
+    are already at hand, otherwise vectorData is scanned for them.
+
+    When preview is set to a fraction only that share of vectorData is sampled.
+    The figures then show estimates with 95% confidence intervals, are titled as
+    approximate and are saved with a '_preview' suffix.
+    """
+    suffix = '_preview' if preview else ''
+    if not preview and aggregates is None:
+        aggregates = aggregate_throughput_and_delay(vec_connection, processes, memory_budget, windows)
+
+    # Received bytes per time window across every host application.
+    if preview:
+        ids = vector_aggregation.vector_ids(vec_connection, 'packetReceived:vector(packetBytes)', '%]')
+        received = vector_aggregation.preview_vectors(vec_connection, ids, preview, bins=50, time_bins=windows)
+        timesums, timesums_error = received['timesums']
+        time_edges = received['time_edges']
+        note = ' (approximate, %.1f%% sample)' % (received['fraction'] * 100)
+    else:
+        received = aggregates['received']
+        timesums, timesums_error = received.totals()['timesums'], None
+        time_edges = received.time_edges
+        note = ''
+    to_megabits = 8 / np.diff(time_edges) / 10 ** 6
+    throughput_megabits = timesums * to_megabits
+
+    fig, ax = plt.subplots()
+    ax.step(time_edges[:-1], throughput_megabits, where='post')
+    if timesums_error is not None:
+        ax.fill_between(time_edges[:-1], throughput_megabits - timesums_error * to_megabits,
+                        throughput_megabits + timesums_error * to_megabits, step='post', alpha=0.3)
+    fig.set_figwidth(9)
+    fig.set_figheight(4)
+    plt.title('Throughput Over Time' + note)
+    plt.xlabel('Simulation Time (in sec)')
+    plt.ylabel('Throughput (in Mbps)')
+    figure_output.savefig('throughput_over_time%s.png' % suffix)
+    plt.clf()
 
-    info_experiment = sca_connection.execute("""\
-                                SELECT attrValue FROM runAttr
-                                WHERE  attrName='experiment'""").fetchall()[0][0]
+    # End-to-end delay statistics and CDF.
+    if preview:
+        ids = vector_aggregation.vector_ids(vec_connection, 'endToEndDelay:vector', '%]')
+        delays = vector_aggregation.preview_vectors(vec_connection, ids, preview, bins=100, time_bins=1)
+        cdf, cdf_error = delays['cdf']
+        data = [['%.0f +/- %.0f' % delays['count'], '%.6g +/- %.2g' % delays['mean'],
+                 delays['min'], delays['max']]]
+        column_labels = ['Packets (est.)', 'Average Delay (sec, est.)', 'Minimum Delay in Sample (sec)',
+                         'Maximum Delay in Sample (sec)']
+        bins_count = delays['bin_edges']
+    else:
+        delay_partials = aggregates['delays']
+        delays = delay_partials.totals()
+        count = delays['hist']
+        # A run without endToEndDelay vectors gets an empty table row and a flat CDF.
+        pdf = count / sum(count) if delays['count'] else count
+        cdf, cdf_error = np.cumsum(pdf), None
+        average = delays['sum'] / delays['count'] if delays['count'] else None
+        data = [[delays['count'], average, delays['min'], delays['max']]]
+        column_labels = ['Packets', 'Average Delay (sec)', 'Minimum Delay (sec)', 'Maximum Delay (sec)']
+        bins_count = delay_partials.bin_edges
 
-    info_network = sca_connection.execute("""\
-                                SELECT attrValue FROM runAttr
-                                WHERE  attrName='network'""").fetchall()[0][0]
+    fig, ax = plt.subplots()
+    ax.axis('off')
+    if preview:
+        ax.set_title('Approximate, %.1f%% sample, 95%% confidence intervals' % (delays['fraction'] * 100))
+    table = ax.table(cellText=data, colLabels=column_labels, loc='center')
+    table.scale(3, 3)
+    table.set_fontsize(24)
+    figure_output.savefig('spineleaf_delay_table%s.png' % suffix, bbox_inches='tight')
+    plt.clf()
 
-    info_total_apps = sca_connection.execute("""\
-                                 SELECT SUM(paramValue) FROM runParam
-                                 WHERE  LIKE('%.numApps', paramKey)=1""").fetchall()[0][0]
+    plt.plot(bins_count[1:], cdf, label='Delay CDF')
+    if cdf_error is not None:
+        plt.fill_between(bins_count[1:], cdf - cdf_error, cdf + cdf_error, alpha=0.3)
+    plt.title('End-to-End Delay CDF' + note)
+    plt.xlabel('Delay (in sec)')
+    plt.ylabel('CDF')
+    figure_output.savefig('delay_cdf%s.png' % suffix)
+    plt.clf()
 
-    info_leafs = sca_connection.execute("""\
-                                SELECT paramValue FROM runParam
-                                WHERE  LIKE('%.leafs', paramKey)=1""").fetchall()[0][0]
 
-    info_hosts = sca_connection.execute("""\
-                                SELECT paramValue FROM runParam
-                                WHERE  LIKE('%.hosts', paramKey)=1""").fetchall()[0][0]
+def attribute_table(sca_connection):
+    """
+    attribute_table is used to create a table of attributes describing
+    basic information about the table.
+    """
+    # Run attributes and configuration parameters, loaded once per file.
+    info = run_info.run_info(sca_connection)
+    info_configname = info.configname
+    info_datetime = info.datetime
+    info_experiment = info.experiment
+    info_network = info.network
+    info_total_apps = info.total_apps
+    info_leafs = info.leafs
+    info_hosts = info.hosts
 
     # TODO: Number of spines currently must be hardcoded, not ideal
     info_spines = 3
@@ -124,95 +223,94 @@ def attribute_table(sca_connection):
     table = ax.table(cellText=data, colLabels=column_labels, loc='center')
     table.scale(3, 3)
     table.set_fontsize(24)
-    plt.savefig('spineleaf_dc_info_table.png', bbox_inches='tight')
+    figure_output.savefig('spineleaf_dc_info_table.png', bbox_inches='tight')
     plt.clf()
 
 
-def traffic_graphics(sca_connection):
+def collect_traffic(sca_connection):
     """
-    traffic_graphics is intended to create graphics describing the traffic
-    within the network simulation.
+    collect_traffic is used to gather the flows of the network simulation
+    from the runParam table.
 
     The timing and size of 'TcpSessionApp' is used to calculate the flow and track
     traffic. This may be an incorrect representation, more research is needed on how to
     calculate flow in the network.
 
-    Currently this function uses a cursor to iterate over the runParam table and stores
-    the information describing the connections and calculates the total time (tOpen + tSend + tClose)
-    taken and size (sendBytes).
-    TODO: This can probably be accomplished with querying somehow instead of iterating.
+    The flow parameters come from param_values.flow_table, which parses the size
+    (sendBytes) and the total time (tOpen + tSend + tClose) taken of every flow
+    for whole columns at once in any unit. Sizes are returned in MiB and lengths
+    in seconds.
     """
-    # Create cursor for querying runParam table,
-    #   this contains the information we will use.
-    # -------------------------------------------------------
-    # | runId   | paramKey  | paramValue    | paramOrder    |
-    # -------------------------------------------------------
-    cur = sca_connection.execute('SELECT * FROM runParam')
-
-    # head_dict will hold a dictionary of the total amount of data sent during connections
-    # [(frm_leaf, frm_host, to_leaf, to_host) : (size, length)]
-    heat_dict = {}
-
-    sizes_list = []
-    lengths_list = []
-    rates_list = []
-    length = 0
-    size = 0
-    intra_leaf = 0
-    extra_leaf = 0
+    flows = param_values.flow_table(sca_connection)
+    sizes = flows['sendBytes'] / 2 ** 20
+    lengths = flows['tOpen'] + flows['tSend'] + flows['tClose']
 
     # Regex patterns for extracting spine, leaf, host
     pattern1 = '.*\[(\d*)\]\..*\[(\d*)\]..*\[(\d*)\].*'
     pattern2 = '.*\[(\d*)\]\..*\[(\d*)\].*'
+    connected = flows[flows['connectAddress'].notna()]
+    capture = (connected.index.to_series() + '.connectAddress').str.extract(pattern1)
+    capture2 = connected['connectAddress'].str.extract(pattern2)
+    keys = ['frm_leaf', 'frm_host', 'to_leaf', 'to_host']
+    heat = pd.DataFrame({'frm_leaf': capture[0], 'frm_host': capture[1],
+                         'to_leaf': capture2[0], 'to_host': capture2[1],
+                         'size': sizes[connected.index], 'length': lengths[connected.index]}).dropna()
+    heat[keys] = heat[keys].astype(int)
+
+    # heat_dict will hold a dictionary of the total amount of data sent during connections
+    # [(frm_leaf, frm_host, to_leaf, to_host) : (size, length)]
+    totals = heat.groupby(keys)[['size', 'length']].sum()
+    heat_dict = dict(zip(totals.index.tolist(), zip(totals['size'].tolist(), totals['length'].tolist())))
+
+    same_leaf = heat['frm_leaf'] == heat['to_leaf']
+
+    # Flows without a positive length have no rate and are left out of the length and rate lists.
+    timed = np.isfinite(lengths) & (lengths > 0)
+
+    return {'heat_dict': heat_dict, 'sizes_list': sizes.tolist(), 'lengths_list': lengths[timed].tolist(),
+            'rates_list': (sizes[timed] / lengths[timed]).tolist(), 'intra_leaf': heat.loc[same_leaf, 'size'].sum(),
+            'extra_leaf': heat.loc[~same_leaf, 'size'].sum()}
+
+
+def traffic_levels(heat_dict, hosts=None):
+    """
+    traffic_levels pre-aggregates the heat dict into leaf and host level
+    matrices of the size sent, see lod_heatmap.build_levels.
+
+    hosts is the number of hosts per leaf from the run configuration. Only when it
+    is not set is it taken from the highest host index with traffic, which shifts
+    the leaf blocks when the last hosts of the leaves have no flows.
+    """
+    if not hosts:
+        hosts = max(max(key[1], key[3]) for key in heat_dict) + 1 if heat_dict else 1
+    matrix = lod_heatmap.heat_matrix(heat_dict, hosts)
 
-    # Iterate over database
-    for row in cur:
-        # If row is sendBytes we store the size being sent
-        if 'sendBytes' in row[1]:
-            size = int(row[2][:-3])
-            sizes_list.append(size)
-        # If row is tOpen we reset the length to whatever is stored in the paramValue
-        elif 'tOpen' in row[1]:
-            length = int(row[2][:-1])
-        # If row is tSend we add the time to our length
-        elif 'tSend' in row[1]:
-            length += int(row[2][:-1])
-        # If row is tClose we add the length and append the total length to our list
-        elif 'tClose' in row[1]:
-            length += int(row[2][:-1])
-            lengths_list.append(length)
-            rates_list.append(size / length)
-        # connectAddress always comes last after the other information
-        elif 'connectAddress' in row[1]:
-            # Use regex to extract host and leaf information
-            capture = re.search(pattern1, row[1])
-
-            frm_leaf = int(capture.group(1))
-            frm_host = int(capture.group(2))
-
-            capture = re.search(pattern2, row[2])
-
-            to_leaf = int(capture.group(1))
-            to_host = int(capture.group(2))
-
-            # Create entry or update heat dictionary
-            if (frm_leaf, frm_host, to_leaf, to_host) in heat_dict:
-                old_size, old_len = heat_dict[(frm_leaf, frm_host, to_leaf, to_host)]
-                heat_dict[(frm_leaf, frm_host, to_leaf, to_host)] = (old_size + size, old_len + length)
-            else:
-                heat_dict[(frm_leaf, frm_host, to_leaf, to_host)] = (size, length)
-
-            if frm_leaf == to_leaf:
-                intra_leaf += size
-            else:
-                extra_leaf += size
+    return lod_heatmap.build_levels(matrix, [('leaf', hosts), ('host', 1)])
+
+
+def traffic_graphics(sca_connection, traffic=None, heats=None):
+    """
+    traffic_graphics is intended to create graphics describing the traffic
+    within the network simulation.
+
+    traffic can be passed in when the flows from collect_traffic are already
+    at hand, otherwise they are collected from sca_connection, and likewise
+    heats for the levels from traffic_levels.
+    """
+    if traffic is None:
+        traffic = collect_traffic(sca_connection)
+    sizes_list = traffic['sizes_list']
+    lengths_list = traffic['lengths_list']
+    rates_list = traffic['rates_list']
+    intra_leaf = traffic['intra_leaf']
+    extra_leaf = traffic['extra_leaf']
 
     # Plot the results.
     # Intra-Leaf vs Extra-Leaf
     fig, ax = plt.subplots()
     ax.pie([intra_leaf, extra_leaf], labels=['Intra-Leaf', 'Extra-Leaf'], autopct='%1.1f%%')
     ax.set_title('Leaf Traffic')
-    plt.savefig('spineleaf_intravsextra_leaf.png')
+    figure_output.savefig('spineleaf_intravsextra_leaf.png')
     plt.clf()
 
     # Flow Size CDF scaled like literature
@@ -236,7 +334,7 @@ def traffic_graphics(sca_connection):
     plt.title('Flow Size CDF')
     plt.xlabel('Flow Size (in bytes)')
     plt.ylabel('CDF')
-    plt.savefig('flow_size_cdf.png')
+    figure_output.savefig('flow_size_cdf.png')
     plt.clf()
 
     # Flow Size CDF
@@ -256,7 +354,7 @@ def traffic_graphics(sca_connection):
     plt.title('Flow Size CDF')
     plt.xlabel('Flow Size (in bytes)')
     plt.ylabel('CDF')
-    plt.savefig('flow_size_notscaled_cdf.png')
+    figure_output.savefig('flow_size_notscaled_cdf.png')
     plt.clf()
 
     # Flow Length CDF scaled like literature
@@ -280,7 +378,7 @@ def traffic_graphics(sca_connection):
     plt.title('Flow Length CDF')
     plt.xlabel('Flow Length (in usecs)')
     plt.ylabel('CDF')
-    plt.savefig('flow_length_cdf.png')
+    figure_output.savefig('flow_length_cdf.png')
     plt.clf()
 
     # Flow Length CDF
@@ -296,7 +394,7 @@ def traffic_graphics(sca_connection):
     plt.title('Flow Length CDF')
     plt.xlabel('Flow Length (in usecs)')
     plt.ylabel('CDF')
-    plt.savefig('flow_length_not_scaled_cdf.png')
+    figure_output.savefig('flow_length_not_scaled_cdf.png')
     plt.clf()
 
     # Flow Rate CDF scaled like literature
@@ -321,7 +419,7 @@ def traffic_graphics(sca_connection):
     plt.title('Flow Rate CDF')
     plt.xlabel('Flow Rate (in Mbps)')
     plt.ylabel('CDF')
-    plt.savefig('flow_rate_cdf.png')
+    figure_output.savefig('flow_rate_cdf.png')
     plt.clf()
 
     # Flow Rate CDF
@@ -339,93 +437,102 @@ def traffic_graphics(sca_connection):
     plt.title('Flow Rate CDF')
     plt.xlabel('Flow Rate (in Mbps)')
     plt.ylabel('CDF')
-    plt.savefig('flow_rate_cdf.png')
+    figure_output.savefig('flow_rate_cdf.png')
     plt.clf()
 
-    # TODO: Traffic Heatmap using Seaborn and heat dict.
-
-
-def utilization_and_drop_graphics(sca_connection):
+    # Traffic Heatmap between hosts and between leaves, pre-aggregated from the
+    #   heat dict and drawn as raster images so large topologies render quickly.
+    if heats is None:
+        heats = traffic_levels(traffic['heat_dict'], run_info.run_info(sca_connection).hosts)
+    for level, plural in [('leaf', 'leaves'), ('host', 'hosts')]:
+        size = heats[level].shape[0]
+        fig, ax = plt.subplots()
+        fig.set_figwidth(9)
+        fig.set_figheight(8)
+        lod_heatmap.render(heats[level], ax, list(range(size)) if level == 'leaf' else None)
+        ax.set_xlabel(level.capitalize() + ' From')
+        ax.set_ylabel(level.capitalize() + ' To')
+        ax.set_title('Traffic Between %s (in MiB)' % plural.capitalize())
+        if level == 'host':
+            lod_heatmap.separate_blocks(ax, size, size // max(heats['leaf'].shape[0], 1))
+        figure_output.savefig('spineleaf_traffic_between_%s.png' % plural)
+        plt.clf()
+
+
+def collect_utilization(sca_connection):
     """
-    spineleaf_utilization_and_drop_graphics_sql is used to calculate and visualize
-    information regarding the utilization of links within the network.
+    collect_utilization is used to gather information regarding the utilization
+    of links and the packets transferred and dropped within the network.
 
-    TODO: Currently iterates over the database but could probably be done by querying the database instead.
+    The scalar table is read in one go (straight from Parquet for columnar results)
+    and every scalar is assigned to the first entry of columnar_export.SCALAR_COUNTS
+    its name contains.
     """
-    # Create cursor for querying scalar table,
-    #   this contains the utilization and packet
-    #   drop information we will use.
     # -----------------------------------------------------------------------
     # | scalarId   | runID  | moduleName    | scalarName    | scalarValue   |
     # -----------------------------------------------------------------------
-    cur = sca_connection.execute('SELECT * FROM scalar')
-
-    # Initialize values for all the informatino we will be storing.
-    # This includes utilization information and information for each type of drop.
-    utilizations = []
-    spine_utilizations = []
-    leaf_utilizations = []
-    transfer_count = 0
-    receive_count = 0
-    tr_spine_count = 0
-    tr_leaf_count = 0
-    re_spine_count = 0
-    re_leaf_count = 0
-    pd_bad_checksum = 0
-    pd_wrong_port = 0
-    pd_address_resolution_failed = 0
-    pd_forwarding_disabled = 0
-    pd_hop_limit_reached = 0
-    pd_incorrectly_received = 0
-    pd_interface_down = 0
-    pd_no_interface_found = 0
-    pd_no_route_found = 0
-    pd_not_addressed_to_us = 0
-    pd_queue_overflow = 0
-    pd_undefined = 0
-    for row in cur:
-        if 'rx channel utilization' in row[3]:
-            utilizations.append(row[4])
-            if 'spine[' in row[2]:
-                spine_utilizations.append(row[4])
-            else:
-                leaf_utilizations.append(row[4])
-        elif 'txPk:count' in row[3]:
-            transfer_count += int(row[4])
-            if 'spine[' in row[2]:
-                tr_spine_count += int(row[4])
-            elif 'leaf[' or 'borderLeaf' in row[2]:
-                tr_leaf_count += int(row[4])
-        elif 'rxPkOk:count' in row[3]:
-            receive_count += int(row[4])
-            if 'spine[' in row[2]:
-                re_spine_count += int(row[4])
-            elif 'leaf[' or 'borderLeaf' in row[2]:
-                re_leaf_count += int(row[4])
-        elif 'droppedPkBadChecksum:count' in row[3]:
-            pd_bad_checksum += row[4]
-        elif 'droppedPkWrongPort:count' in row[3]:
-            pd_wrong_port += row[4]
-        elif 'packetDropAddressResolutionFailed:count' in row[3]:
-            pd_address_resolution_failed += row[4]
-        elif 'packetDropForwardingDisabled:count' in row[3]:
-            pd_forwarding_disabled += row[4]
-        elif 'packetDropHopLimitReached:count' in row[3]:
-            pd_hop_limit_reached += row[4]
-        elif 'packetDropIncorrectlyReceived:count' in row[3]:
-            pd_incorrectly_received += row[4]
-        elif 'packetDropInterfaceDown:count' in row[3]:
-            pd_interface_down += row[4]
-        elif 'packetDropNoInterfaceFound:count' in row[3]:
-            pd_no_interface_found += row[4]
-        elif 'packetDropNoRouteFound:count' in row[3]:
-            pd_no_route_found += row[4]
-        elif 'packetDropNotAddressedToUs:count' in row[3]:
-            pd_not_addressed_to_us += row[4]
-        elif 'packetDropQueueOverflow:count' in row[3]:
-            pd_queue_overflow += row[4]
-        elif 'packetDropUndefined:count' in row[3]:
-            pd_undefined += row[4]
+    scalars = columnar_export.read_table(sca_connection, 'scalar', ['moduleName', 'scalarName', 'scalarValue'])
+    keys = [key for key, _ in columnar_export.SCALAR_COUNTS]
+    category = columnar_export.scalar_categories(scalars['scalarName'])
+    values = scalars['scalarValue']
+    codes, modules = pd.factorize(scalars['moduleName'])
+    spine = np.array(['spine[' in str(module) for module in modules] + [False], dtype=bool)[codes]
+
+    # Utilization of every link, split between spine and leaf switches.
+    utilization = category == keys.index('utilizations')
+    collected = {'utilizations': values[utilization].tolist(),
+                 'spine_utilizations': values[utilization & spine].tolist(),
+                 'leaf_utilizations': values[utilization & ~spine].tolist()}
+
+    # Packets transferred and received, counted as whole packets. Every switch that
+    # is not a spine counts as a leaf (including border leafs).
+    for key, prefix in [('transfer_count', 'tr'), ('receive_count', 're')]:
+        selected = category == keys.index(key)
+        counts = np.trunc(values[selected]).astype(np.int64)
+        spine_counts = np.trunc(values[selected & spine]).astype(np.int64)
+        leaf_counts = np.trunc(values[selected & ~spine]).astype(np.int64)
+        collected[key] = int(counts.sum())
+        collected['%s_spine_count' % prefix] = int(spine_counts.sum())
+        collected['%s_leaf_count' % prefix] = int(leaf_counts.sum())
+
+    # Packet drops of each reason.
+    for key, _ in columnar_export.SCALAR_COUNTS[3:]:
+        # Added up in row order like the per row loop this replaced, so totals match exactly.
+        collected[key] = sum(values[category == keys.index(key)].tolist(), 0)
+
+    return collected
+
+
+def utilization_and_drop_graphics(sca_connection, utilization=None):
+    """
+    utilization_and_drop_graphics is used to visualize information regarding
+    the utilization of links within the network.
+
+    utilization can be passed in when the results of collect_utilization are
+    already at hand, otherwise they are collected from sca_connection.
+    """
+    if utilization is None:
+        utilization = collect_utilization(sca_connection)
+    utilizations = utilization['utilizations']
+    spine_utilizations = utilization['spine_utilizations']
+    leaf_utilizations = utilization['leaf_utilizations']
+    transfer_count = utilization['transfer_count']
+    receive_count = utilization['receive_count']
+    tr_spine_count = utilization['tr_spine_count']
+    tr_leaf_count = utilization['tr_leaf_count']
+    re_spine_count = utilization['re_spine_count']
+    re_leaf_count = utilization['re_leaf_count']
+    pd_bad_checksum = utilization['pd_bad_checksum']
+    pd_wrong_port = utilization['pd_wrong_port']
+    pd_address_resolution_failed = utilization['pd_address_resolution_failed']
+    pd_forwarding_disabled = utilization['pd_forwarding_disabled']
+    pd_hop_limit_reached = utilization['pd_hop_limit_reached']
+    pd_incorrectly_received = utilization['pd_incorrectly_received']
+    pd_interface_down = utilization['pd_interface_down']
+    pd_no_route_found = utilization['pd_no_route_found']
+    pd_not_addressed_to_us = utilization['pd_not_addressed_to_us']
+    pd_queue_overflow = utilization['pd_queue_overflow']
+    pd_undefined = utilization['pd_undefined']
 
     # Generate a table/chart with some info about
     #   utilization and loss in the simulation.
@@ -441,7 +548,7 @@ def utilization_and_drop_graphics(sca_connection):
     table = ax.table(cellText=data, colLabels=column_labels, loc='center')
     table.scale(3, 3)
     table.set_fontsize(24)
-    plt.savefig('spineleaf_utilization_table.png', bbox_inches='tight')
+    figure_output.savefig('spineleaf_utilization_table.png', bbox_inches='tight')
 
     data2 = [[pd_bad_checksum, pd_wrong_port, pd_address_resolution_failed, pd_forwarding_disabled,
               pd_hop_limit_reached, pd_incorrectly_received, pd_interface_down, pd_no_route_found,
@@ -452,14 +559,14 @@ def utilization_and_drop_graphics(sca_connection):
     table2 = ax.table(cellText=data2, colLabels=column_labels2, loc='center')
     table2.scale(3, 3)
     table2.set_fontsize(24)
-    plt.savefig('spineleaf_packet_drop_table.png', bbox_inches='tight')
+    figure_output.savefig('spineleaf_packet_drop_table.png', bbox_inches='tight')
 
     data3 = [[transfer_count, tr_spine_count, tr_leaf_count, receive_count, re_spine_count, re_leaf_count]]
     column_labels3 = ['Packets Transferred', 'Packets Transferred From Spine', 'Packets Transferred from Leaf', 'Packets Received', 'Packets Received in Spine', 'Packets Received in Leaf']
     table3 = ax.table(cellText=data3, colLabels=column_labels3, loc='center')
     table3.scale(3, 3)
     table3.set_fontsize(24)
-    plt.savefig('spineleaf_packet_table.png', bbox_inches='tight')
+    figure_output.savefig('spineleaf_packet_table.png', bbox_inches='tight')
     plt.clf()
 
     # Utilization CDF
@@ -480,7 +587,7 @@ def utilization_and_drop_graphics(sca_connection):
     plt.title('Utilization CDF')
     plt.xlabel('Utilization')
     plt.ylabel('CDF')
-    plt.savefig('utilization_cdf.png')
+    figure_output.savefig('utilization_cdf.png')
     plt.clf()
 
     # Spine Utilization CDF
@@ -501,7 +608,7 @@ def utilization_and_drop_graphics(sca_connection):
     plt.title('Spine Utilization CDF')
     plt.xlabel('Spine Utilization')
     plt.ylabel('CDF')
-    plt.savefig('spine_utilization_cdf.png')
+    figure_output.savefig('spine_utilization_cdf.png')
     plt.clf()
 
     # Leaf Utilization CDF
@@ -522,14 +629,24 @@ def utilization_and_drop_graphics(sca_connection):
     plt.title('Leaf Utilization CDF')
     plt.xlabel('Leaf Utilization')
     plt.ylabel('CDF')
-    plt.savefig('leaf_utilization_cdf.png')
+    figure_output.savefig('leaf_utilization_cdf.png')
     plt.clf()
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Generate graphics for a spine-leaf network simulation.')
+    parser.add_argument('--vec', default='/workspaces/share/spineleaf/test-#0.vec', help='vector results file')
+    parser.add_argument('--sca', default='/workspaces/share/spineleaf/test-#0.sca', help='scalar results file')
+    parser.add_argument('--preview', type=vector_aggregation.preview_fraction, nargs='?', const=0.01,
+                        metavar='FRACTION',
+                        help='estimate vector metrics from a sample of vectorData (default 0.01)')
+    figure_output.add_arguments(parser)
+    args = parser.parse_args()
+    figure_output.configure_from_args(args)
+
     # Path for database to be opened.
-    vec_database = '/workspaces/share/spineleaf/test-#0.vec'
-    sca_database = '/workspaces/share/spineleaf/test-#0.sca'
+    vec_database = args.vec
+    sca_database = args.sca
 
     # Create connections to database files.
     vec_connection = create_connection(vec_database)
@@ -540,11 +657,15 @@ def main():
     traffic_graphics(sca_connection)
     utilization_and_drop_graphics(sca_connection)
     throughput_graph(vec_connection)
+    throughput_and_delay_graphics(vec_connection, preview=args.preview)
 
     # Close connections.
     vec_connection.close()
     sca_connection.close()
 
+    # Wait for the figures still being written.
+    figure_output.flush()
+
 
 if __name__ == '__main__':
     main()
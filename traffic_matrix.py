@@ -0,0 +1,152 @@
+"""
+traffic_matrix.py
+
+This file builds a time-sliced rack to rack traffic matrix from the
+packets actually received during an OMNeT++ simulation.
+
+Received-packet vectors are mapped to a (source rack, destination rack)
+pair using the connectAddress parameters of the traffic applications.
+vectorData is then streamed once and the received bytes are accumulated
+into a (time window x source rack x destination rack) array with numpy
+bincount, so memory use depends on the number of windows and racks and not
+on the number of packets.
+"""
+import re
+import warnings
+import numpy as np
+import vector_aggregation
+import param_values
+
+
+# Pattern for the bracketed indices in module names, parameter keys and addresses,
+# e.g. cell[0].rack[1].host[2].app[0] -> cell, rack, host, app.
+INDEX_PATTERN = re.compile(r'\[(\d+)\]')
+
+
+def _indices(text):
+    return tuple(int(i) for i in INDEX_PATTERN.findall(text))
+
+
+def vector_attribution(connection, vector_ids, racks):
+    """
+    vector_attribution is used to decide which rack pair the packets of each
+    received-packet vector belong to.
+
+    A vector recorded by an application with a connectAddress received its packets
+    from the connected host. A vector recorded by any other application on a host
+    (a sink) is shared between every flow connecting to that host, weighted by the
+    configured sendBytes of the flows.
+
+    Returns (vectorIds, sources, destinations, weights) numpy arrays sorted by
+    vectorId, where a vector may appear once per contributing flow.
+    """
+    # Flows keyed by source application, (cell, rack, host, app) -> (to_cell, to_rack, to_host).
+    flows = {}
+    sizes = {}
+    table = param_values.flow_table(connection)
+    for module, row in table[table['connectAddress'].notna()].iterrows():
+        app = _indices(module)[:4]
+        flows[app] = _indices(row['connectAddress'])[:3]
+        sizes[app] = row['sendBytes'] if row['sendBytes'] > 0 else 1.0
+
+    # Flows arriving at each destination host, (cell, rack, host) -> [(from_rack_index, weight)].
+    incoming = {}
+    for app, destination in flows.items():
+        incoming.setdefault(destination, []).append((app[0] * racks + app[1], sizes.get(app, 1.0)))
+
+    ids, sources, destinations, weights = [], [], [], []
+    cur = connection.execute('SELECT vectorId, moduleName FROM vector WHERE vectorId IN (%s)'
+                             % ','.join(str(int(i)) for i in vector_ids))
+    for vector_id, module_name in cur:
+        module = _indices(module_name)
+        if len(module) < 3:
+            continue
+        to_rack = module[0] * racks + module[1]
+        if module[:4] in flows:
+            remote = flows[module[:4]]
+            senders = [(remote[0] * racks + remote[1], 1.0)]
+        else:
+            senders = incoming.get(module[:3], [])
+        total = sum(weight for _, weight in senders)
+        for from_rack, weight in senders:
+            ids.append(vector_id)
+            sources.append(from_rack)
+            destinations.append(to_rack)
+            weights.append(weight / total)
+
+    order = np.argsort(ids, kind='stable')
+    return (np.array(ids, dtype=np.int64)[order], np.array(sources, dtype=np.int64)[order],
+            np.array(destinations, dtype=np.int64)[order], np.array(weights, dtype=np.float64)[order])
+
+
+def build_traffic_matrix(connection, total_racks, racks, windows=10,
+                         vector_name='packetReceived:vector(packetBytes)',
+                         memory_budget=vector_aggregation.DEFAULT_MEMORY_BUDGET):
+    """
+    build_traffic_matrix is used to accumulate received bytes into a
+    (windows x total_racks x total_racks) array in a single pass over vectorData.
+
+    racks is the number of racks per cell, used to turn (cell, rack) into a rack index.
+    Returns the matrix and the window edges in seconds. Bytes received by vectors
+    that no flow can be attributed to (e.g. a sink no flow connects to) are left
+    out of the matrix with a warning.
+    """
+    vector_ids = vector_aggregation.vector_ids(connection, vector_name)
+    ids, sources, destinations, weights = vector_attribution(connection, vector_ids, racks)
+    matrix = np.zeros(windows * total_racks * total_racks)
+
+    time_min, time_max = vector_aggregation.vector_bounds(connection, vector_ids)[2:]
+    if time_min is None:
+        return matrix.reshape(windows, total_racks, total_racks), np.linspace(0, 1, windows + 1)
+    time_edges = np.linspace(time_min, max(time_max, time_min + 1e-12), windows + 1)
+
+    # Compressed layout of the attribution, each vector owns ids[starts[i]:starts[i] + counts[i]].
+    unique_ids, starts, counts = np.unique(ids, return_index=True, return_counts=True)
+
+    raw_edges = vector_aggregation.raw_time_edges(connection, time_edges)
+
+    chunk_rows = max(vector_aggregation.MIN_CHUNK_ROWS, memory_budget // 2 // vector_aggregation.ROW_COST)
+    received = unattributed = 0.0
+    for vector_rows, simtimes, values in vector_aggregation.iter_vector_chunks(connection, vector_ids, chunk_rows):
+        received += values.sum()
+        slot = np.minimum(np.searchsorted(unique_ids, vector_rows), max(len(unique_ids) - 1, 0))
+        attributed = unique_ids[slot] == vector_rows if len(unique_ids) else np.zeros(len(vector_rows), dtype=bool)
+        unattributed += values[~attributed].sum()
+        slot, simtimes, values = slot[attributed], simtimes[attributed], values[attributed]
+        if not len(slot):
+            continue
+        window = np.clip(np.searchsorted(raw_edges, simtimes, side='right') - 1, 0, windows - 1)
+        # Vectors shared by several flows contribute once per flow, every pair is added up in one bincount.
+        flat, flow_bytes = [], []
+        for k in range(counts.max()):
+            rows = counts[slot] > k
+            pair = starts[slot[rows]] + k
+            flat.append((window[rows] * total_racks + sources[pair]) * total_racks + destinations[pair])
+            flow_bytes.append(values[rows] * weights[pair])
+        chunk = np.bincount(np.concatenate(flat), weights=np.concatenate(flow_bytes))
+        matrix[:len(chunk)] += chunk
+
+    if unattributed:
+        warnings.warn('%.0f of %.0f received bytes could not be attributed to a flow and are left out '
+                      'of the traffic matrix' % (unattributed, received))
+
+    return matrix.reshape(windows, total_racks, total_racks), time_edges
+
+
+def hot_spots(matrix, time_edges, top=5):
+    """
+    hot_spots returns the top rack pairs of every window as a list of
+    (window_start, window_end, from_rack, to_rack, bytes) tuples.
+    """
+    summary = []
+    for window, traffic in enumerate(matrix):
+        flat = traffic.ravel()
+        count = min(top, np.count_nonzero(flat))
+        if count == 0:
+            continue
+        best = np.argpartition(flat, -count)[-count:]
+        for index in best[np.argsort(flat[best])[::-1]]:
+            from_rack, to_rack = divmod(int(index), traffic.shape[1])
+            summary.append((time_edges[window], time_edges[window + 1], from_rack, to_rack, flat[index]))
+
+    return summary
@@ -0,0 +1,549 @@
+"""
+vector_aggregation.py
+
+This file provides an out-of-core aggregation runner for the vectorData
+table of OMNeT++ SQLite results files.
+
+vectorData is read in rowid ranges sized from a memory budget. Only
+per-vector partial aggregates (count, sum, min, max, histogram bins and
+time-binned sums) are kept between ranges. When the partials outgrow their
+share of the budget they are spilled to a temporary SQLite store and merged
+back together at the end, so vector based metrics can be computed on files
+much larger than RAM.
+
+parallel_aggregate_vectors shards the rowid range of vectorData across a
+process pool. Each worker opens its own read-only connection and returns
+VectorPartials which are merged in the parent. The speedup depends on the
+cores available, measure it with e.g.
+python benchmark_baselines.py record --stages spineleaf.delay --processes 4
+On a single core machine a 4.3M row vectorData took 4.9 s with 1 process,
+3.5 s with 2 and 5.5 s with 4 (spineleaf.delay, median of 3), so there
+the pool only pays off through its smaller per-worker chunks.
+
+preview_vectors estimates the same aggregates from a uniform sample of
+rowid blocks, with confidence intervals, for a quick first look at a run.
+
+Connections returned by columnar_export.load_columnar are read from their
+Parquet vectorData instead, with row positions standing in for rowids.
+
+vectorData layout:
+-------------------------------------------------------
+| vectorId  | eventNumber   | simtimeRaw    | value   |
+-------------------------------------------------------
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+from multiprocessing import Pool
+from urllib.request import pathname2url
+import numpy as np
+import columnar_export
+
+
+# Default memory budget for a single aggregation run, in bytes.
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+
+# Rough cost in bytes of one fetched vectorData row while it is still a
+# Python tuple, before being converted to numpy columns.
+ROW_COST = 160
+
+# Smallest number of rows read per rowid range.
+MIN_CHUNK_ROWS = 4096
+
+# vectorData with fewer rows than this many chunks per worker is scanned in
+# the calling process, starting a pool would cost more than it saves.
+PARALLEL_MIN_CHUNKS = 4
+
+# Number of equal rowid blocks vectorData is divided into for sampling.
+SAMPLE_BLOCKS = 1000
+
+# Normal quantile for the 95% confidence intervals of sampled estimates.
+CONFIDENCE_Z = 1.96
+
+
+def vector_ids(connection, vector_name, module_like=None):
+    """
+    vector_ids is used to look up the vectorIds recorded under vector_name,
+    optionally restricted to modules matching the SQL LIKE pattern module_like.
+    """
+    query = 'SELECT vectorId FROM vector WHERE vectorName=?'
+    params = [vector_name]
+    if module_like is not None:
+        query += ' and LIKE(?, moduleName)=1'
+        params.append(module_like)
+    query += ' ORDER BY vectorId'
+
+    return [row[0] for row in connection.execute(query, params)]
+
+
+def simtime_scale(connection):
+    """
+    simtime_scale returns the factor converting simtimeRaw values into seconds.
+    """
+    columnar_path = getattr(connection, 'columnar_path', None)
+    if columnar_path:
+        return 10.0 ** columnar_export.simtime_exponent(columnar_path)
+    exponent = connection.execute('SELECT simtimeExp FROM run').fetchall()[0][0]
+
+    return 10.0 ** exponent
+
+
+def vector_bounds(connection, ids):
+    """
+    vector_bounds uses the summary columns of the vector table to find the value
+    and time range covered by ids without reading vectorData.
+
+    Returns (value_min, value_max, time_min, time_max) with times in seconds.
+    """
+    bounds = connection.execute("""\
+                    SELECT MIN(vectorMin), MAX(vectorMax),
+                           MIN(startSimtimeRaw), MAX(endSimtimeRaw)
+                    FROM vector
+                    WHERE vectorId IN (%s)""" % _id_list(ids)).fetchall()[0]
+    if bounds[2] is None:
+        return bounds
+    scale = simtime_scale(connection)
+
+    return bounds[0], bounds[1], bounds[2] * scale, bounds[3] * scale
+
+
+def vector_data_extent(connection):
+    """
+    vector_data_extent returns the (first_rowid, last_rowid) of vectorData, or
+    (None, None) when it is empty.
+    """
+    columnar_path = getattr(connection, 'columnar_path', None)
+    if columnar_path:
+        rows = columnar_export.vector_data_rows(columnar_path)
+        return (0, rows - 1) if rows else (None, None)
+
+    return tuple(connection.execute('SELECT MIN(rowid), MAX(rowid) FROM vectorData').fetchall()[0])
+
+
+def raw_time_edges(connection, time_edges):
+    """
+    raw_time_edges converts time edges in seconds into simtimeRaw edges, so rows
+    can be windowed on their exact integer simtimeRaw.
+    """
+    return np.ceil(np.asarray(time_edges) / simtime_scale(connection)).astype(np.int64)
+
+
+def iter_vector_chunks(connection, ids, chunk_rows, ranges=None):
+    """
+    iter_vector_chunks walks vectorData in rowid ranges of chunk_rows rows and
+    yields (vector_ids, simtimes, values) numpy arrays for the rows of ids.
+
+    simtimes are the int64 simtimeRaw values, float64 cannot hold them exactly
+    past 2^53, see raw_time_edges for windowing them.
+
+    ranges can be given as a list of (first_rowid, last_rowid) pairs to restrict
+    the walk, otherwise the whole table is covered.
+    """
+    if ranges is None:
+        first, last = vector_data_extent(connection)
+        ranges = [] if first is None else [(first, last)]
+
+    columnar_path = getattr(connection, 'columnar_path', None)
+    if columnar_path:
+        yield from columnar_export.iter_vector_data(columnar_path, ids, chunk_rows, ranges)
+        return
+
+    id_list = _id_list(ids)
+    for first, last in ranges:
+        for lo in range(first, last + 1, chunk_rows):
+            hi = min(lo + chunk_rows - 1, last)
+            rows = connection.execute("""\
+                    SELECT vectorId, simtimeRaw, value FROM vectorData
+                    WHERE  rowid BETWEEN ? AND ?
+                           and vectorId IN (%s)""" % id_list, (lo, hi)).fetchall()
+            if not rows:
+                continue
+            vector_ids, simtimes, values = zip(*rows)
+            yield (np.array(vector_ids, dtype=np.int64), np.array(simtimes, dtype=np.int64),
+                   np.array(values, dtype=np.float64))
+
+
+class VectorPartials:
+    """
+    VectorPartials holds mergeable partial aggregates for a set of vectors.
+
+    Every array is indexed by the position of the vector in ids (kept sorted),
+    hist has one row of value bins per vector and timesums one row of
+    time-binned value sums per vector. Two partials built with the same bin and
+    time edges can be merged in any order.
+    """
+
+    def __init__(self, ids, counts, sums, mins, maxs, hist, timesums, bin_edges, time_edges):
+        self.ids = ids
+        self.counts = counts
+        self.sums = sums
+        self.mins = mins
+        self.maxs = maxs
+        self.hist = hist
+        self.timesums = timesums
+        self.bin_edges = bin_edges
+        self.time_edges = time_edges
+
+    @classmethod
+    def empty(cls, bin_edges, time_edges):
+        """
+        empty creates partials covering no vectors.
+        """
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0),
+                   np.empty(0), np.empty(0),
+                   np.empty((0, len(bin_edges) - 1), dtype=np.int64),
+                   np.empty((0, len(time_edges) - 1)),
+                   bin_edges, time_edges)
+
+    @classmethod
+    def from_rows(cls, vector_ids, simtimes, values, bin_edges, time_edges, raw_edges):
+        """
+        from_rows aggregates a chunk of vectorData rows into partials, windowing
+        the simtimeRaw values on raw_edges (time_edges in simtimeRaw units).
+        """
+        ids, slots = np.unique(vector_ids, return_inverse=True)
+        n = len(ids)
+        n_bins = len(bin_edges) - 1
+        n_time_bins = len(time_edges) - 1
+
+        counts = np.bincount(slots, minlength=n)
+        sums = np.bincount(slots, weights=values, minlength=n)
+        mins = np.full(n, np.inf)
+        np.minimum.at(mins, slots, values)
+        maxs = np.full(n, -np.inf)
+        np.maximum.at(maxs, slots, values)
+
+        value_bins = np.clip(np.searchsorted(bin_edges, values, side='right') - 1, 0, n_bins - 1)
+        hist = np.bincount(slots * n_bins + value_bins, minlength=n * n_bins).reshape(n, n_bins)
+
+        time_bins = np.clip(np.searchsorted(raw_edges, simtimes, side='right') - 1, 0, n_time_bins - 1)
+        timesums = np.bincount(slots * n_time_bins + time_bins, weights=values,
+                               minlength=n * n_time_bins).reshape(n, n_time_bins)
+
+        return cls(ids, counts, sums, mins, maxs, hist, timesums, bin_edges, time_edges)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ids, self.counts, self.sums, self.mins,
+                                      self.maxs, self.hist, self.timesums))
+
+    def merge(self, other):
+        """
+        merge combines two partials into a new one, reducing vectors present in both.
+        """
+        ids = np.concatenate((self.ids, other.ids))
+        merged_ids, slots = np.unique(ids, return_inverse=True)
+        n = len(merged_ids)
+
+        def reduce(a, b, ufunc, initial):
+            out = np.full((n,) + a.shape[1:], initial, dtype=np.result_type(a, b))
+            ufunc.at(out, slots, np.concatenate((a, b)))
+            return out
+
+        return VectorPartials(merged_ids,
+                              reduce(self.counts, other.counts, np.add, 0),
+                              reduce(self.sums, other.sums, np.add, 0),
+                              reduce(self.mins, other.mins, np.minimum, np.inf),
+                              reduce(self.maxs, other.maxs, np.maximum, -np.inf),
+                              reduce(self.hist, other.hist, np.add, 0),
+                              reduce(self.timesums, other.timesums, np.add, 0),
+                              self.bin_edges, self.time_edges)
+
+    def totals(self):
+        """
+        totals reduces the partials over every vector and returns a dictionary
+        with count, sum, min, max, hist and timesums.
+        """
+        return {
+            'count': int(self.counts.sum()),
+            'sum': float(self.sums.sum()),
+            'min': float(self.mins.min()) if len(self.ids) else None,
+            'max': float(self.maxs.max()) if len(self.ids) else None,
+            'hist': self.hist.sum(axis=0),
+            'timesums': self.timesums.sum(axis=0),
+        }
+
+
+class _SpillStore:
+    """
+    _SpillStore keeps spilled VectorPartials in a temporary SQLite file.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix='vector_partials_')
+        self.con = sqlite3.connect(os.path.join(self.directory, 'partials.sqlite'))
+        self.con.execute("""\
+                    CREATE TABLE partials (vectorId INTEGER, count INTEGER, sum REAL,
+                                           min REAL, max REAL, hist BLOB, timesums BLOB)""")
+        self.spills = 0
+
+    def write(self, partials):
+        self.con.executemany('INSERT INTO partials VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             ((int(partials.ids[i]), int(partials.counts[i]), float(partials.sums[i]),
+                               float(partials.mins[i]), float(partials.maxs[i]),
+                               partials.hist[i].tobytes(), partials.timesums[i].tobytes())
+                              for i in range(len(partials.ids))))
+        self.con.commit()
+        self.spills += 1
+
+    def read(self, bin_edges, time_edges):
+        """
+        read merges everything that was spilled, one vector at a time.
+        """
+        self.con.execute('CREATE INDEX partials_idx ON partials(vectorId)')
+        merged = self.con.execute("""\
+                    SELECT vectorId, SUM(count), SUM(sum), MIN(min), MAX(max)
+                    FROM partials GROUP BY vectorId ORDER BY vectorId""").fetchall()
+        n = len(merged)
+        hist = np.zeros((n, len(bin_edges) - 1), dtype=np.int64)
+        timesums = np.zeros((n, len(time_edges) - 1))
+        slot = -1
+        last_id = None
+        cur = self.con.execute('SELECT vectorId, hist, timesums FROM partials ORDER BY vectorId')
+        for vector_id, hist_blob, time_blob in cur:
+            if vector_id != last_id:
+                slot += 1
+                last_id = vector_id
+            hist[slot] += np.frombuffer(hist_blob, dtype=np.int64)
+            timesums[slot] += np.frombuffer(time_blob)
+
+        columns = list(zip(*merged)) if merged else [[]] * 5
+        return VectorPartials(np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype=np.int64),
+                              np.array(columns[2], dtype=np.float64), np.array(columns[3], dtype=np.float64),
+                              np.array(columns[4], dtype=np.float64), hist, timesums,
+                              bin_edges, time_edges)
+
+    def close(self):
+        self.con.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def default_edges(connection, ids, bins, time_bins):
+    """
+    default_edges builds evenly spaced value and time bin edges covering ids.
+    """
+    value_min, value_max, time_min, time_max = vector_bounds(connection, ids)
+    if value_min is None:
+        value_min, value_max, time_min, time_max = 0.0, 1.0, 0.0, 1.0
+
+    return (np.linspace(value_min, max(value_max, value_min + 1e-12), bins + 1),
+            np.linspace(time_min, max(time_max, time_min + 1e-12), time_bins + 1))
+
+
+def aggregate_vectors(connection, ids, memory_budget=DEFAULT_MEMORY_BUDGET, bins=100, time_bins=100,
+                      bin_edges=None, time_edges=None, ranges=None):
+    """
+    aggregate_vectors is used to compute VectorPartials for the vectors in ids
+    while staying within memory_budget bytes.
+
+    Half of the budget sizes the rowid ranges read from vectorData, the other half
+    bounds the resident partials. Whenever the resident partials grow past their
+    half they are spilled to a temporary SQLite store and merged at the end.
+    """
+    if bin_edges is None or time_edges is None:
+        default_bins, default_times = default_edges(connection, ids, bins, time_bins)
+        bin_edges = default_bins if bin_edges is None else bin_edges
+        time_edges = default_times if time_edges is None else time_edges
+
+    chunk_rows = max(MIN_CHUNK_ROWS, memory_budget // 2 // ROW_COST)
+    resident_budget = memory_budget // 2
+
+    raw_edges = raw_time_edges(connection, time_edges)
+
+    resident = VectorPartials.empty(bin_edges, time_edges)
+    store = None
+    try:
+        for chunk in iter_vector_chunks(connection, ids, chunk_rows, ranges):
+            resident = resident.merge(VectorPartials.from_rows(*chunk, bin_edges, time_edges, raw_edges))
+            if resident.nbytes > resident_budget:
+                if store is None:
+                    store = _SpillStore()
+                store.write(resident)
+                resident = VectorPartials.empty(bin_edges, time_edges)
+
+        if store is not None:
+            resident = store.read(bin_edges, time_edges).merge(resident)
+    finally:
+        if store is not None:
+            store.close()
+
+    return resident
+
+
+def database_path(connection):
+    """
+    database_path returns the file backing connection so worker processes can reopen it.
+    """
+    columnar_path = getattr(connection, 'columnar_path', None)
+    if columnar_path:
+        return columnar_path
+
+    for row in connection.execute('PRAGMA database_list'):
+        if row[1] == 'main':
+            return row[2]
+
+    return ''
+
+
+def shard_ranges(connection, shards):
+    """
+    shard_ranges splits the rowid range of vectorData into shards contiguous
+    (first_rowid, last_rowid) ranges of roughly equal size.
+    """
+    first, last = vector_data_extent(connection)
+    if first is None:
+        return []
+    bounds = np.linspace(first, last + 1, shards + 1).astype(np.int64)
+
+    return [(int(lo), int(hi) - 1) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def _aggregate_shard(args):
+    path, ids, memory_budget, bin_edges, time_edges, rowid_range = args
+    if columnar_export.is_columnar(path):
+        # Tables are loaded lazily and the edges are given, so a shard only reads run.parquet.
+        con = columnar_export.load_columnar(path)
+    else:
+        con = sqlite3.connect('file:%s?mode=ro' % pathname2url(path), uri=True)
+    try:
+        return aggregate_vectors(con, ids, memory_budget, bin_edges=bin_edges,
+                                 time_edges=time_edges, ranges=[rowid_range])
+    finally:
+        con.close()
+
+
+def parallel_aggregate_vectors(connection, ids, processes=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                               bins=100, time_bins=100, bin_edges=None, time_edges=None):
+    """
+    parallel_aggregate_vectors is used to compute VectorPartials for ids with the
+    vectorData scan partitioned by rowid range across a pool of processes.
+
+    Bin and time edges are fixed in the parent so every shard produces mergeable
+    partials, and memory_budget is shared evenly between the workers. Falls back
+    to aggregate_vectors when a single process is requested, the database has
+    no file to reopen or vectorData is less than PARALLEL_MIN_CHUNKS chunks.
+    """
+    processes = processes or os.cpu_count() or 1
+    path = database_path(connection)
+    first, last = vector_data_extent(connection)
+    rows = 0 if first is None else last - first + 1
+    chunk_rows = max(MIN_CHUNK_ROWS, memory_budget // processes // 2 // ROW_COST)
+    if processes == 1 or not path or rows < PARALLEL_MIN_CHUNKS * chunk_rows:
+        return aggregate_vectors(connection, ids, memory_budget, bins, time_bins, bin_edges, time_edges)
+
+    if bin_edges is None or time_edges is None:
+        default_bins, default_times = default_edges(connection, ids, bins, time_bins)
+        bin_edges = default_bins if bin_edges is None else bin_edges
+        time_edges = default_times if time_edges is None else time_edges
+
+    # Use more shards than processes so uneven ranges still balance out.
+    shards = [(path, ids, memory_budget // processes, bin_edges, time_edges, rowid_range)
+              for rowid_range in shard_ranges(connection, processes * 4)]
+
+    result = VectorPartials.empty(bin_edges, time_edges)
+    with Pool(processes) as pool:
+        for partials in pool.imap_unordered(_aggregate_shard, shards):
+            result = result.merge(partials)
+
+    return result
+
+
+def preview_fraction(text):
+    """
+    preview_fraction is an argparse type for --preview, accepting a fraction in (0, 1].
+    """
+    try:
+        fraction = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('%r is not a number' % text)
+    if not 0 < fraction <= 1:
+        raise argparse.ArgumentTypeError('the preview fraction must be in (0, 1], got %s' % text)
+
+    return fraction
+
+
+def sample_ranges(connection, fraction, blocks=SAMPLE_BLOCKS, seed=None):
+    """
+    sample_ranges divides vectorData into blocks equal rowid ranges and picks a
+    uniform random fraction of them, at least two so a variance can be estimated.
+
+    Returns the sorted list of sampled (first_rowid, last_rowid) ranges and the
+    total number of blocks.
+    """
+    ranges = shard_ranges(connection, blocks)
+    count = min(len(ranges), max(2, int(np.ceil(fraction * len(ranges)))))
+    picked = np.sort(np.random.default_rng(seed).choice(len(ranges), count, replace=False))
+
+    return [ranges[i] for i in picked], len(ranges)
+
+
+def _estimate_total(y, total_blocks):
+    # Expansion estimator of a total from per-block totals y, with its confidence half-width.
+    k = len(y)
+    variance = total_blocks ** 2 * (1 - k / total_blocks) * y.var(axis=0, ddof=1) / k
+
+    return total_blocks * y.mean(axis=0), CONFIDENCE_Z * np.sqrt(variance)
+
+
+def _estimate_ratio(y, x, total_blocks):
+    # Ratio estimator of sum(y) / sum(x) from per-block totals, with its confidence half-width.
+    k = len(y)
+    x_total = x.sum()
+    if x_total == 0:
+        return np.zeros(y.shape[1:]), np.zeros(y.shape[1:])
+    ratio = y.sum(axis=0) / x_total
+    residuals = y - np.multiply.outer(x, ratio) if y.ndim > 1 else y - ratio * x
+    variance = (1 - k / total_blocks) * residuals.var(axis=0, ddof=1) / (k * x.mean() ** 2)
+
+    return ratio, CONFIDENCE_Z * np.sqrt(variance)
+
+
+def preview_vectors(connection, ids, fraction, bins=100, time_bins=100, bin_edges=None, time_edges=None,
+                    blocks=SAMPLE_BLOCKS, seed=None):
+    """
+    preview_vectors is used to estimate the aggregates of ids from a uniform sample
+    of fraction of the rowid blocks of vectorData instead of a full scan.
+
+    Every sampled block is aggregated on its own so the spread between blocks gives
+    95% confidence intervals. Returns a dictionary where count, sum, mean, cdf and
+    timesums are (estimate, half_width) pairs, min and max are taken from the sample
+    and fraction is the share of blocks actually read.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError('fraction must be in (0, 1], got %r' % fraction)
+    if bin_edges is None or time_edges is None:
+        default_bins, default_times = default_edges(connection, ids, bins, time_bins)
+        bin_edges = default_bins if bin_edges is None else bin_edges
+        time_edges = default_times if time_edges is None else time_edges
+
+    ranges, total_blocks = sample_ranges(connection, fraction, blocks, seed)
+    samples = [aggregate_vectors(connection, ids, bin_edges=bin_edges, time_edges=time_edges,
+                                 ranges=[rowid_range]).totals() for rowid_range in ranges]
+    if len(samples) < 2:
+        raise ValueError('vectorData has too few rows to sample')
+
+    counts = np.array([sample['count'] for sample in samples], dtype=np.float64)
+    sums = np.array([sample['sum'] for sample in samples])
+    cumulative = np.cumsum([sample['hist'] for sample in samples], axis=1).astype(np.float64)
+    timesums = np.array([sample['timesums'] for sample in samples])
+    mins = [sample['min'] for sample in samples if sample['min'] is not None]
+    maxs = [sample['max'] for sample in samples if sample['max'] is not None]
+
+    return {
+        'fraction': len(ranges) / total_blocks,
+        'bin_edges': bin_edges,
+        'time_edges': time_edges,
+        'count': _estimate_total(counts, total_blocks),
+        'sum': _estimate_total(sums, total_blocks),
+        'mean': _estimate_ratio(sums, counts, total_blocks),
+        'min': min(mins) if mins else None,
+        'max': max(maxs) if maxs else None,
+        'cdf': _estimate_ratio(cumulative, counts, total_blocks),
+        'timesums': _estimate_total(timesums, total_blocks),
+    }
+
+
+def _id_list(ids):
+    return ','.join(str(int(i)) for i in ids) or 'NULL'